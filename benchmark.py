@@ -0,0 +1,345 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+Performance benchmarks for `todo.py`. Results are printed as JSON, so
+successive runs can be compared.
+
+Usage:
+    benchmark.py importtime [--runs N]
+    benchmark.py render [--sizes N,N,...]
+    benchmark.py log [--calls N]
+    benchmark.py generate --tasks N [--format txt|json] [--seed S] OUTPUT
+    benchmark.py phases [--sizes N,N,...] [--format txt|json]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+
+# Dependencies which only some of the code paths need
+LAZY_IMPORTS = ["simple_term_menu", "parsedatetime", "dateutil.parser", "tabulate", "gzip"]
+
+
+def _importtime(statement, depth=0):
+    """
+    Runs `statement` in a fresh interpreter w/ `-X importtime`. Returns
+    `{module: cumulative microseconds}` for the imports at nesting level
+    `depth`.
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=ROOT,
+        capture_output=True, text=True, check=True).stderr
+    ret = dict()
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+
+        _, cumulative, name = line.split("|")
+
+        if not cumulative.strip().isdigit():
+            continue  # Header
+
+        # Nested imports are indented by 2 spaces per level
+        if (len(name) - len(name.lstrip()) - 1) // 2 == depth:
+            ret[name.strip()] = int(cumulative)
+
+    return ret
+
+
+def bench_importtime(runs):
+    """
+    Measures how long `import todo` takes, and how much the heavy
+    dependencies would add, if they were imported eagerly
+    """
+    totals = []
+    totals_eager = []
+    modules = dict()
+
+    for _ in range(runs):
+        totals.append(_importtime("import todo")["todo"])
+
+        for name, us in _importtime("import todo", depth=1).items():
+            modules.setdefault(name, []).append(us)
+
+        imported = _importtime("import todo; " + "; ".join("import " + m for m in LAZY_IMPORTS))
+        totals_eager.append(sum(us for name, us in imported.items() if name == "todo" or name in LAZY_IMPORTS))
+
+    top = sorted(((statistics.median(v), k) for k, v in modules.items()), reverse=True)[:10]
+
+    return {
+        "benchmark": "importtime",
+        "runs": runs,
+        "import_todo_us": statistics.median(totals),
+        "import_todo_eager_us": statistics.median(totals_eager),
+        "top_modules_us": {k: v for v, k in top},
+    }
+
+
+def _render_cells(n):
+    """
+    Generates `n` cells shaped like the ones `TextFormat.task_format_filter_default`
+    renders
+    """
+    import todo
+
+    rnd = random.Random(n)
+    words = ["WORK", "HOME", "-", "claim", "the", "usb", "hub", "back", "**bold**", "https://example.com/?q=1"]
+    ret = []
+
+    for _ in range(n):
+        header = " ".join(rnd.choices(words, k=rnd.randint(2, 8)))
+        details = "\n".join(" ".join(rnd.choices(words, k=rnd.randint(1, 8))) for _ in range(rnd.choice([0, 0, 1, 3])))
+
+        if len(details):
+            header = todo.Color.colorize_bold(header)
+
+        ret.append((todo.Color.colorize_bold(" +") if rnd.random() < 0.7 else " ✓", header + "\n" + details))
+
+    return ret
+
+
+def bench_render(sizes):
+    """
+    Compares `TextFormat.table_format_marker` against `tabulate` on the same
+    cells, verifies that the outputs are identical
+    """
+    import todo
+
+    ret = {"benchmark": "render", "sizes": []}
+
+    for n in sizes:
+        cells = _render_cells(n)
+
+        t = time.perf_counter()
+        expected = [todo.TextFormat._table_format_marker_tabulate(m, c) for m, c in cells]
+        time_tabulate = time.perf_counter() - t
+
+        t = time.perf_counter()
+        rendered = [todo.TextFormat.table_format_marker(m, c) for m, c in cells]
+        time_fast = time.perf_counter() - t
+
+        assert rendered == expected, "the renderer's output differs from tabulate's"
+        ret["sizes"].append({
+            "tasks": n,
+            "tabulate_s": time_tabulate,
+            "renderer_s": time_fast,
+            "speedup": time_tabulate / time_fast,
+        })
+
+    return ret
+
+
+def _is_path_legacy(arg):
+    return os.path.isfile(arg) or os.path.isdir(arg)
+
+
+def bench_log(calls):
+    """
+    Measures `Log.debug` calls at the default INFO level against formatting
+    the same messages eagerly, w/ two `stat` calls per string argument, as
+    every call used to
+    """
+    import logging
+    import todo
+    from generic import Log
+
+    task = "WORK - claim the usb hub back tomorrow\n" * 4
+    logger = logging.getLogger()
+    level = logger.level
+    is_path = Log.__dict__["_is_path"]
+    ret = {"benchmark": "log", "calls": calls}
+
+    def run(fn):
+        t = time.perf_counter()
+
+        for _ in range(calls):
+            fn()
+
+        return (time.perf_counter() - t) / calls * 1e9
+
+    try:
+        logger.setLevel(logging.INFO)
+        ret["debug_disabled_ns"] = run(lambda: Log.debug("parsing info for task", task))
+        ret["format_path_context_ns"] = run(lambda: Log.format(todo.__file__, "waiting"))
+        Log._is_path = staticmethod(_is_path_legacy)
+        ret["debug_eager_format_ns"] = run(lambda: logging.debug(Log.format("parsing info for task", task)))
+        ret["format_path_context_eager_ns"] = run(lambda: Log.format(todo.__file__, "waiting"))
+    finally:
+        Log._is_path = is_path
+        logger.setLevel(level)
+
+    return ret
+
+
+TAGS = ["WORK", "HOME", "SHOP", "LOW", "IMPORTANT", "PENDING"]
+WORDS = ["claim", "the", "usb", "hub", "back", "call", "review", "report", "fix", "bike", "write", "code", "bob",
+    "**bold**"]
+DATES = ["tomorrow", "in 2 hours", "by friday", "next week", "07-02", "14:02", "2027-03-01"]
+
+
+def generate_tasks(n, seed=0, markers=True):
+    """
+    Generates `n` tasks the way they are stored in "todo.txt": tag prefixes,
+    multi-line details w/ URLs, natural-language dates, "@due" and "@done"
+    markers. Returns `(task, done)` pairs.
+    """
+    rnd = random.Random(seed)
+    start = datetime.datetime(2026, 1, 1)
+    ret = []
+
+    for i in range(n):
+        lines = ["%s - %s %d" % (rnd.choice(TAGS), " ".join(rnd.choices(WORDS, k=rnd.randint(1, 6))), i)]
+
+        if rnd.random() < 0.3:
+            lines[0] += " " + rnd.choice(DATES)
+
+        for _ in range(rnd.choice([0, 0, 1, 2, 4])):
+            line = " ".join(rnd.choices(WORDS, k=4))
+
+            if rnd.random() < 0.3:
+                line += " https://example.com/issues/%d?q=%d" % (rnd.randint(1, 9999), i)
+
+            lines.append(line)
+
+        due = start + datetime.timedelta(minutes=rnd.randint(0, 2 * 365 * 24 * 60))
+        done = rnd.random() < 0.4
+
+        if markers and rnd.random() < 0.5:
+            lines.append("@due " + due.strftime("%Y-%m-%d %H:%M"))
+
+        if markers and done:
+            lines.append("@done")
+
+        ret.append(("\n".join(lines), done))
+
+    return ret
+
+
+def generate(n, output, fmt="txt", seed=0):
+    """
+    Writes a synthetic "todo.txt", or "todo.json" w/ the tasks parsed
+    """
+    import todo
+
+    if fmt == "txt":
+        serialized = "\n\n".join(t for t, _ in generate_tasks(n, seed))
+    else:
+        store = todo.TaskStore()
+
+        for task, done in generate_tasks(n, seed, markers=False):
+            store.add(task, "done" if done else "todo", todo.Queue._task_parse_info(task))
+
+        serialized = todo.Queue(store)._as_serialized()
+
+    with open(output, 'w') as f:
+        f.write(serialized)
+
+
+def _timed(fn):
+    t = time.perf_counter()
+    ret = fn()
+
+    return time.perf_counter() - t, ret
+
+
+def _peak_memory(fn):
+    tracemalloc.start()
+
+    try:
+        fn()
+
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_phases(sizes, fmt="txt"):
+    """
+    Times loading (w/o and w/ the parse cache), sorting, formatting,
+    searching (plain and fuzzy), and saving of synthetic queues. Peak memory
+    of loading and formatting is measured in a separate run, as tracing
+    slows them down.
+    """
+    import todo
+
+    queue_type = todo.PlainTextQueue if fmt == "txt" else todo.Queue
+    cwd = os.getcwd()
+    ret = {"benchmark": "phases", "format": fmt, "sizes": []}
+
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as queue_dir:
+            os.chdir(queue_dir)
+
+            try:
+                generate(n, "todo." + fmt, fmt)
+                result = {"tasks": n, "file_bytes": os.path.getsize("todo." + fmt)}
+                result["load_cold_s"], q = _timed(lambda: queue_type.load(from_here=True))
+                result["load_s"], q = _timed(lambda: queue_type.load(from_here=True))
+                result["sort_s"], _ = _timed(lambda: q.store.sort("todo", todo.Queue._task_sort_key))
+                result["format_s"], _ = _timed(lambda: sum(map(len, todo.TextFormat.queue_format_complete(q))))
+                result["search_first_s"], _ = _timed(lambda: q.search_and(["claim", "usb"], False))
+                result["search_s"], _ = _timed(lambda: q.search_and(["review", "bob"], False))
+                result["search_fuzzy_s"], _ = _timed(lambda: q.search_fuzzy(["reviw", "bob"]))
+                q.add("benchmark task")
+                result["save_s"], _ = _timed(lambda: q.save(here=True))
+                result["load_peak_bytes"] = _peak_memory(lambda: queue_type.load(from_here=True))
+                q = queue_type.load(from_here=True)
+                result["format_peak_bytes"] = _peak_memory(
+                    lambda: sum(map(len, todo.TextFormat.queue_format_complete(q))))
+            finally:
+                os.chdir(cwd)
+
+        ret["sizes"].append(result)
+
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="todo.py benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    importtime = subparsers.add_parser("importtime", help="Import time of todo.py")
+    importtime.add_argument("--runs", type=int, default=5)
+    render = subparsers.add_parser("render", help="Task rendering, tabulate vs the plain renderer")
+    render.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated numbers of tasks")
+    log = subparsers.add_parser("log", help="Disabled debug logging")
+    log.add_argument("--calls", type=int, default=100000)
+    generator = subparsers.add_parser("generate", help="Write a synthetic queue file")
+    generator.add_argument("--tasks", type=int, required=True)
+    generator.add_argument("--format", choices=["txt", "json"], default="txt")
+    generator.add_argument("--seed", type=int, default=0)
+    generator.add_argument("output")
+    phases = subparsers.add_parser("phases", help="Load, sort, format, search, and save of synthetic queues")
+    phases.add_argument("--sizes", default="100,1000,10000,100000", help="Comma-separated numbers of tasks")
+    phases.add_argument("--format", choices=["txt", "json"], default="txt")
+    args = parser.parse_args()
+
+    if args.benchmark == "importtime":
+        result = bench_importtime(args.runs)
+    elif args.benchmark == "render":
+        result = bench_render(list(map(int, args.sizes.split(','))))
+    elif args.benchmark == "log":
+        result = bench_log(args.calls)
+    elif args.benchmark == "generate":
+        generate(args.tasks, args.output, args.format, args.seed)
+
+        return
+    elif args.benchmark == "phases":
+        result = bench_phases(list(map(int, args.sizes.split(','))), args.format)
+
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import logging
 import pathlib
 import os
+import stat
 import inspect
 import time
 import threading
@@ -9,26 +10,51 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 
 
 class Log:
+	"""
+	Messages get formatted only if their level is enabled, so disabled calls
+	(e.g. `Log.debug` at the default INFO level) cost a level check.
+	"""
+
+	@staticmethod
+	def log(level, *args, **kwargs):
+		logger = logging.getLogger()
+
+		if logger.isEnabledFor(level):
+			logger.log(level, Log.format(*args, **kwargs))
 
 	@staticmethod
 	def info(*args, **kwargs):
-		return logging.info(Log.format(*args, **kwargs))
+		return Log.log(logging.INFO, *args, **kwargs)
 
 	@staticmethod
 	def warning(*args, **kwargs):
-		return logging.warning(Log.format(*args, **kwargs))
+		return Log.log(logging.WARNING, *args, **kwargs)
 
 	@staticmethod
 	def error(*args, **kwargs):
-		return logging.error(Log.format(*args, **kwargs))
+		return Log.log(logging.ERROR, *args, **kwargs)
 
 	@staticmethod
 	def debug(*args, **kwargs):
-		return logging.debug(Log.format(*args, **kwargs))
+		return Log.log(logging.DEBUG, *args, **kwargs)
 
 	@staticmethod
 	def critical(*args, **kwargs):
-		return logging.critical(Log.format(*args, **kwargs))
+		return Log.log(logging.CRITICAL, *args, **kwargs)
+
+	@staticmethod
+	def _is_path(arg):
+		"""
+		Whether a string names a file or a directory, w/ a single `stat` call
+		instead of the two of `isfile()` and `isdir()`. Not cached, as files
+		come and go while the daemon runs
+		"""
+		try:
+			mode = os.stat(arg).st_mode
+		except (OSError, ValueError):
+			return False
+
+		return stat.S_ISREG(mode) or stat.S_ISDIR(mode)
 
 	@staticmethod
 	def format(*args, **kwargs):
@@ -49,7 +75,7 @@ class Log:
 		def is_path(arg):
 			if type(arg) is not str:
 				return False
-			return os.path.isfile(arg) or os.path.isdir(arg)
+			return Log._is_path(arg)
 
 		def format_path(arg):
 			return pathlib.Path(arg).stem
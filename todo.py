@@ -1,22 +1,35 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
+# Heavy dependencies (simple_term_menu, parsedatetime, dateutil, tabulate,
+# gzip, sqlite3), and the modules only some backends need (struct, array,
+# mmap, signal, socket) are imported by the code paths which use them, so the
+# most frequent invocations, like the bare listing, do not pay for them. See
+# `benchmark.py importtime`.
+import time
+IMPORT_START = time.perf_counter()  # Taken before the other imports, see `Trace`
 import sys
 import os
-from simple_term_menu import TerminalMenu
 from pathlib import Path
 from dataclasses import dataclass, field
 import datetime
-from parsedatetime import Calendar
 import json
-from dateutil.parser import parse as date_parse
-import tabulate
 import colorama
 import re
 from generic import Log
 import shutil
 import textwrap
-import gzip
+import hashlib
+import bisect
+import heapq
+import functools
+import io
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, locking gets disabled
+    fcntl = None
 
 
 TIME_FORMAT = "%Y-%m-%d %H:%M"
@@ -24,14 +37,13 @@ DUMP_TIME_FORMAT = "%Y%m%d%H%M%S"
 CURRENT_TIME = datetime.datetime.strftime(datetime.datetime.now(), TIME_FORMAT)
 DUMP_DURRENT_TIME = datetime.datetime.strftime(datetime.datetime.now(), DUMP_TIME_FORMAT)
 VERSION = "1.5.0"
-tabulate.PRESERVE_WHITESPACE = True
 
 
-def list_remove_item(l, item):
-    try:
-        l.remove(item)
-    except ValueError:
-        pass
+def _tabulate():
+    import tabulate
+    tabulate.PRESERVE_WHITESPACE = True
+
+    return tabulate
 
 def _dict_try_get_value(d, key):
     try:
@@ -39,6 +51,130 @@ def _dict_try_get_value(d, key):
     except KeyError:
         return None
 
+def _file_write_atomic(file_path, content, mode='w'):
+    """
+    Writes into a temporary file in the same directory, flushes it onto the
+    disk, and renames it over `file_path`. Thus, the file is always either
+    old or new, but never truncated. A symlink is written through, i.e. its
+    target gets replaced
+    """
+    import tempfile
+
+    file_path = os.path.realpath(file_path)
+    directory = os.path.dirname(file_path)
+    fd, temp_file_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(file_path) + ".",
+        suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # `mkstemp` creates files accessible by the owner only
+        try:
+            shutil.copymode(file_path, temp_file_path)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_file_path, 0o666 & ~umask)
+
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_file_path)
+        except OSError:
+            pass
+
+        raise
+
+    # Make the rename itself durable
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+    Trace.count("bytes written", os.path.getsize(file_path))
+
+
+class Trace:
+    """
+    Opt-in instrumentation, enabled by `--profile` or `TODO_TRACE=1`. Times
+    the phases of a run, counts the expensive operations, and writes the
+    breakdown to stderr at exit. `--profile=FILE` also dumps `cProfile`
+    stats, see `python3 -m pstats FILE`. While disabled, every call costs a
+    flag check.
+    """
+    enabled = False
+    profile_file = None
+    profiler = None
+    phases = []  # `[depth, name, seconds]` in the order the phases have started
+    depth = 0
+    counters = dict()
+    # Dependencies imported lazily, reported if a run has needed them
+    LAZY_IMPORTS = ["simple_term_menu", "parsedatetime", "dateutil", "tabulate", "gzip", "sqlite3"]
+
+    @staticmethod
+    def enable(profile_file=None):
+        Trace.enabled = True
+        Trace.phases.append([0, "imports", time.perf_counter() - IMPORT_START])
+
+        if profile_file is not None:
+            import cProfile
+
+            Trace.profile_file = profile_file
+            Trace.profiler = cProfile.Profile()
+            Trace.profiler.enable()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def phase(name):
+        if not Trace.enabled:
+            yield
+
+            return
+
+        entry = [Trace.depth, name, 0.0]
+        Trace.phases.append(entry)
+        Trace.depth += 1
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            entry[2] = time.perf_counter() - start
+            Trace.depth -= 1
+
+    @staticmethod
+    def count(name, n=1):
+        if Trace.enabled:
+            Trace.counters[name] = Trace.counters.get(name, 0) + n
+
+    @staticmethod
+    def report():
+        if not Trace.enabled:
+            return
+
+        if Trace.profiler is not None:
+            Trace.profiler.disable()
+            Trace.profiler.dump_stats(Trace.profile_file)
+
+        lines = ["%s%-*s %9.3f ms" % ("  " * depth, 24 - 2 * depth, name, seconds * 1000)
+            for depth, name, seconds in Trace.phases]
+        lines += ["%-24s %9d" % (name, n) for name, n in Trace.counters.items()]
+        imported = [m for m in Trace.LAZY_IMPORTS if m in sys.modules]
+        lines.append("%-24s %s" % ("lazy imports", ", ".join(imported) or "none"))
+
+        if Trace.profile_file is not None:
+            lines.append("%-24s %s" % ("profile", Trace.profile_file))
+
+        sys.stderr.write('\n'.join(lines) + '\n')
+
 
 class Color:
 
@@ -69,33 +205,44 @@ class Color:
         [r"\*\*\w+\*\*", lambda text: Color.colorize_wrap(text, colorama.Style.BRIGHT)],
     ]
 
-    @staticmethod
-    def _chunk_append(chunks, text, pos_last, pos_from, pos_to, formatter):
-        chunk_before = text[pos_last:pos_from]
-        chunk_range = formatter(text[pos_from : pos_to])
-        chunks += [chunk_before, chunk_range]
-
-        return chunks
-
     @staticmethod
     def colorize_bold(s):
         return Color.colorize_wrap(s, colorama.Style.BRIGHT)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _compile(patterns, re_flags):
+        """
+        Compiles rule patterns into a single alternation. Each rule gets
+        wrapped into a named group, so `Match.lastgroup` tells which one has
+        matched. Bounded, as each set of search terms compiles its own
+        pattern, and the daemon lives long
+        """
+        return re.compile('|'.join("(?P<r%d>%s)" % (i, p) for i, p in enumerate(patterns)), flags=re_flags)
+
     @staticmethod
     def colorize(text: str, rules=RULES, re_flags=0):
-        for rule, formatter in rules:
-            chunks = []
-            pos_last = 0
+        """
+        Applies the rules in a single left-to-right pass. Of overlapping
+        matches, the leftmost one wins, then the one whose rule goes first.
+        """
+        if rules is Color.RULES and re_flags == 0:
+            return Color._colorize_default(text)
+
+        return Color._colorize(text, rules, re_flags)
 
-            for m in re.finditer(rule, text, flags=re_flags):
-                chunks = Color._chunk_append(chunks, text, pos_last, *m.span(0), formatter)
-                pos_last = m.span(0)[1]
+    @staticmethod
+    @functools.lru_cache(maxsize=16384)
+    def _colorize_default(text):
+        return Color._colorize(text, Color.RULES, 0)
 
-            if 0 < pos_last:
-                chunks.append(text[pos_last:])
-                text = "".join(chunks)
+    @staticmethod
+    def _colorize(text, rules, re_flags):
+        scanner = Color._compile(tuple(rule for rule, _ in rules), re_flags)
+        formatters = [formatter for _, formatter in rules]
+        Trace.count("regex scans")
 
-        return text
+        return scanner.sub(lambda m: formatters[int(m.lastgroup[1:])](m.group(0)), text)
 
 
 class TextFormat:
@@ -103,9 +250,10 @@ class TextFormat:
     @staticmethod
     def task_format(q, task, formatters):
         ret = task
+        info = q.task_info(task)
 
         for fmt in formatters:
-            ret = fmt(ret, **q.task_info(task))
+            ret = fmt(ret, **info)
 
             if ret is None:
                 return None
@@ -113,21 +261,34 @@ class TextFormat:
         return ret
 
     @staticmethod
-    def _queue_format(q, formatters_todo, formatters_done=None):
-        formatted = ["TODO:"]
-        formatted += list(map(lambda t: TextFormat.task_format(q, t, formatters_todo), q.todo_tasks()))
+    def _queue_format(q, formatters_todo, formatters_done=None, limit=None, todo=None):
+        """
+        Lazily yields formatted entries, so the output may be written as it
+        gets rendered. Stops after `limit` tasks, if provided. `todo` - tasks to
+        format instead of all the "todo" ones.
+        """
+        sections = [("TODO:", q.tasks_iter("todo") if todo is None else todo, formatters_todo)]
 
         if formatters_done is not None:
-            formatted += ["DONE:"]
-            formatted += list(map(lambda t: TextFormat.task_format(q, t, formatters_done), q.done_tasks()))
+            sections += [("DONE:", q.tasks_iter("done"), formatters_done)]
+
+        for title, tasks, formatters in sections:
+            yield title
+
+            for t in tasks:
+                if limit is not None and limit <= 0:
+                    return
 
-        formatted = list(filter(lambda t: t is not None, formatted))
-        formatted = "\n".join(formatted)
+                formatted = TextFormat.task_format(q, t, formatters)
 
-        return formatted
+                if formatted is not None:
+                    yield formatted
+
+                    if limit is not None:
+                        limit -= 1
 
     @staticmethod
-    def queue_format_complete(q):
+    def queue_format_complete(q, limit=None):
         formatters_todo = [
             lambda t, *args, **kwargs: TextFormat.task_format_filter_default(t, *args, **kwargs, istodo=True),
             lambda t, *args, **kwargs: Color.colorize(t)
@@ -136,10 +297,10 @@ class TextFormat:
             lambda t, *args, **kwargs: TextFormat.task_format_filter_default(t, *args, **kwargs, istodo=False)
         ]
 
-        return TextFormat._queue_format(q, formatters_todo, formatters_done)
+        return TextFormat._queue_format(q, formatters_todo, formatters_done, limit)
 
     @staticmethod
-    def queue_format_short(q):
+    def queue_format_short(q, limit=None):
         formatters_todo = [
             lambda t, *args, **kwargs: TextFormat.task_format_filter_short(t, *args, **kwargs, istodo=True),
             lambda t, *args, **kwargs: Color.colorize(t)
@@ -148,29 +309,28 @@ class TextFormat:
             lambda t, *args, **kwargs: TextFormat.task_format_filter_short(t, *args, **kwargs, istodo=False)
         ]
 
-        return TextFormat._queue_format(q, formatters_todo, formatters_done)
+        return TextFormat._queue_format(q, formatters_todo, formatters_done, limit)
 
     @staticmethod
-    def task_format_complete_search_and(queue, queries, match_case):
-        if match_case:
-            adjust_case = lambda x: x
-        else:
-            adjust_case = lambda x: x.lower()
-
-        def colorize_search_highlight(text):
-            for q in queries:
-                text = Color.colorize(text, [[q, lambda t: Color.colorize_wrap(t, *Color.SEARCH_HIGHLIGHT)]], 0 if match_case else re.IGNORECASE)
+    def task_format_complete_search_and(queue, queries, match_case, limit=None, fuzzy=False):
+        """
+        `fuzzy` - show the best fuzzy matches, best first, see `Queue.search_fuzzy`
+        """
+        match_case = match_case and not fuzzy
+        rules_search_highlight = [[q, lambda t: Color.colorize_wrap(t, *Color.SEARCH_HIGHLIGHT)] for q in queries]
 
-            return text
+        @functools.lru_cache(maxsize=None)
+        def colorize_search_highlight(word):
+            return Color.colorize(word, rules_search_highlight, 0 if match_case else re.IGNORECASE)
 
         formatters_todo = [
-            lambda t, *args, **kwargs: t if all(map(lambda q: adjust_case(q) in adjust_case(t), queries)) else None,  # Search for entries that satisfy the query
             lambda t, *args, **kwargs: TextFormat.task_format_filter_default(t, *args, **kwargs, istodo=True),
             lambda t, *args, **kwargs: Color.colorize(t),
             lambda t, *args, **kwargs: Color.colorize(t, [[r'\w+', colorize_search_highlight]]),
         ]
 
-        return TextFormat._queue_format(queue, formatters_todo)
+        return TextFormat._queue_format(queue, formatters_todo, limit=limit,
+            todo=queue.search_fuzzy(queries, top=limit) if fuzzy else queue.search_and(queries, match_case))
 
     __DEFAULT_MULTILINE_SPLITTER = None
 
@@ -215,6 +375,33 @@ class TextFormat:
 
         return ret
 
+    @staticmethod
+    def iter_blocks(lines):
+        """
+        Lazily yields stripped, non-empty blocks of text separated by empty
+        lines. `lines` - text, or an iterable of lines, e.g. a file opened in
+        text mode, which converts CRLF line endings while reading.
+        """
+        if isinstance(lines, str):
+            lines = io.StringIO(lines, newline=None)
+
+        block = []
+
+        for line in lines:
+            if line != '\n':
+                block.append(line)
+            elif len(block):
+                text = "".join(block).strip()
+                block = []
+
+                if len(text):
+                    yield text
+
+        text = "".join(block).strip()
+
+        if len(text):
+            yield text
+
     @staticmethod
     def split_first_line(s):
         assert len(s) > 0
@@ -232,7 +419,8 @@ class TextFormat:
 
     @staticmethod
     def task_format_filter_default(task, *args, **kwargs):
-        due = kwargs.pop("due", None)
+        kwargs.pop("due", None)
+        due_ts = kwargs.pop("due_ts", None)
         details = kwargs.pop("details", "")
         header = kwargs.pop("header")
         header_col_width = 30
@@ -245,26 +433,62 @@ class TextFormat:
         if len(details) > 0:
             header = Color.colorize_bold(header)
 
-        if due is not None:
-            header = "(%s) %s" % (DateTime.deadline_format_remaining(due), header)
+        if due_ts is not None:
+            header = "(%s) %s" % (DateTime.remaining_format(due_ts), header)
 
         details = textwrap.indent(details, ' ')
         header = header + '\n' + details
 
-        formatted = [[marker, header]]
-        ret = tabulate.tabulate(formatted, tablefmt="plain", maxcolwidths=[None, None],
-            colalign=(None, None))
+        return TextFormat.table_format_marker(marker, header)
 
-        return ret
+    __ANSI_CODE = re.compile(r"\x1b\[[\d;]*m")
+    __LINE_BREAKS_NOT_LF = set("\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+    @staticmethod
+    def table_format_marker(marker, text):
+        """
+        Renders a one-row table of a marker and a multiline text. The output is
+        byte-identical to `tabulate`'s "plain" layout w/ whitespace
+        preserved. The corner cases where `tabulate` would treat the text as a
+        number, or split it by line breaks other than LF, are delegated to it.
+        """
+        if not TextFormat.__LINE_BREAKS_NOT_LF.isdisjoint(text):
+            return TextFormat._table_format_marker_tabulate(marker, text)
+
+        try:
+            float(TextFormat.__ANSI_CODE.sub("", text))
+
+            return TextFormat._table_format_marker_tabulate(marker, text)
+        except ValueError:
+            pass
+
+        lines = text.split('\n')
+
+        # `tabulate` drops up to 2 trailing empty lines
+        for _ in range(2):
+            if len(lines) > 1 and len(lines[-1]) == 0:
+                lines.pop()
+
+        indent = ' ' * len(TextFormat.__ANSI_CODE.sub("", marker)) + "  "
+        ret = [(marker + "  " + lines[0]).rstrip()]
+        ret += [(indent + l).rstrip() for l in lines[1:]]
+
+        return '\n'.join(ret)
+
+    @staticmethod
+    def _table_format_marker_tabulate(marker, text):
+        return _tabulate().tabulate([[marker, text]], tablefmt="plain", maxcolwidths=[None, None],
+            colalign=(None, None))
 
     @staticmethod
     def task_format_filter_short(task, *args, **kwargs):
         header = kwargs.pop("header")
-        due = kwargs.pop("due", None)
+        kwargs.pop("due", None)
+        due_ts = kwargs.pop("due_ts", None)
         marker_more = "..." if len(kwargs.pop("details", "")) > 0 else ""
 
-        if due is not None:
-            header = "(%s) %s" % (DateTime.deadline_format_remaining(due), header)
+        if due_ts is not None:
+            header = "(%s) %s" % (DateTime.remaining_format(due_ts), header)
 
         if kwargs.pop("istodo"):
             marker = Color.colorize_bold(" +")
@@ -279,321 +503,1500 @@ class DateTime:
     def get_datetime():
         return CURRENT_TIME
 
+    EPOCH = datetime.datetime(1970, 1, 1)
+
     @staticmethod
-    def parse_datetime(task):
-        date, status = deadline = Calendar().parse(task)
-        # deadline = datetime.datetime.strftime(deadline, TIME_FORMAT)
+    def to_timestamp(dt):
+        """
+        Converts a naive local date into seconds since `EPOCH`. The
+        timestamps preserve local wall-clock arithmetic, so they compare and
+        subtract exactly as the dates themselves do.
+        """
+        return int((dt - DateTime.EPOCH).total_seconds())
+
+    @staticmethod
+    def datetime_from_str(due: str):
+        """
+        Parses dates which are stored in `TIME_FORMAT`, falls back to
+        `dateutil` for the rest
+        """
+        try:
+            return datetime.datetime.strptime(due, TIME_FORMAT)
+        except ValueError:
+            from dateutil.parser import parse as date_parse
+
+            return date_parse(due)
+
+    @staticmethod
+    def timestamp_from_str(due: str):
+        return DateTime.to_timestamp(DateTime.datetime_from_str(due))
+
+    _calendar = None
+    _prefilter = None
+    _reference_time = None  # Relative dates, e.g. "tomorrow", are resolved against it, and deadlines rendered
+    _reference_us = None  # Same, in microseconds since `EPOCH`
+
+    @staticmethod
+    def _calendar_init():
+        """
+        Creates the `parsedatetime.Calendar` once. Builds a regex from its
+        locale that matches every line the calendar could find a date in:
+        digits, names of months and weekdays, units, modifiers, etc. The only
+        single-letter keywords are units, which only count after "a" / "an",
+        as in "in a h".
+        """
+        from parsedatetime import Calendar
+
+        DateTime._calendar = Calendar()
+        locale = DateTime._calendar.ptc.locale
+        keywords = set(locale.re_values["now"]) | set(locale.small) | set(locale.magnitude) | set(locale.re_sources)
+
+        for k in ["months", "shortmonths", "days", "shortdays", "dayoffsets", "numbers", "units", "modifiers", "sources"]:
+            keywords.update(w.replace("\\ ", " ") for w in locale.re_values[k].split('|'))
+
+        for units in locale.units.values():
+            keywords.update(units)
+
+        units_short = "".join(sorted(w for w in keywords if len(w) == 1 and w.isalpha() and w not in "a"))
+        keywords = sorted(w for w in keywords if len(w) > 1)
+        DateTime._prefilter = re.compile(r"\d|" + '|'.join(map(re.escape, keywords)) + r"|\ban?[\W_]*[%s]\b" % units_short,
+            re.IGNORECASE)
+
+    @staticmethod
+    def set_reference_time(reference_time=None):
+        """
+        Sets the time relative dates are resolved against, `datetime.now()`
+        by default. Drops the results cached for the previous one.
+        """
+        DateTime._reference_time = reference_time if reference_time is not None else datetime.datetime.now()
+        DateTime._reference_us = (DateTime._reference_time - DateTime.EPOCH) // datetime.timedelta(microseconds=1)
+        DateTime._parse_datetime_cached.cache_clear()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _parse_datetime_cached(line):
+        Trace.count("regex scans")
+
+        if not DateTime._prefilter.search(line):
+            return None
+
+        Trace.count("parsedatetime calls")
+        date, status = DateTime._calendar.parse(line, sourceTime=DateTime._reference_time)
 
         if status:
             return datetime.datetime(*date[:6])
 
     @staticmethod
-    def deadline_format_remaining(deadline: str):
-        delta = date_parse(deadline) - datetime.datetime.now()
-        expired = delta.total_seconds() < 0
-        delta = datetime.timedelta(seconds=abs(delta.total_seconds()))
-        resoultion_mapping = [
-            (datetime.timedelta(weeks=9), lambda d: "%d months" % int(d.days / 30)),
-            (datetime.timedelta(weeks=2), lambda d: "%d weeks" % int(d.days / 7)),
-            (datetime.timedelta(days=2), lambda d: "%d days" % int(d.days)),
-            (datetime.timedelta(hours=2), lambda d: "%d hours" % int(d.total_seconds() / 3600)),
-            (datetime.timedelta(seconds=-1), lambda d: "%d minutes" % int(d.total_seconds() /  60)),
-        ]
+    def parse_datetime(task):
+        if DateTime._calendar is None:
+            DateTime._calendar_init()
+
+        if DateTime._reference_time is None:
+            DateTime.set_reference_time()
+
+        return DateTime._parse_datetime_cached(task)
+
+    _US = 10 ** 6
+    _DAY_US = 86400 * _US
+    # `(threshold, unit, format)`, in microseconds. Remaining time above the
+    # threshold is shown in whole units
+    _REMAINING_FORMAT = [
+        (9 * 7 * _DAY_US, 30 * _DAY_US, "%d months"),
+        (2 * 7 * _DAY_US, 7 * _DAY_US, "%d weeks"),
+        (2 * _DAY_US, _DAY_US, "%d days"),
+        (2 * 3600 * _US, 3600 * _US, "%d hours"),
+        (-_US, 60 * _US, "%d minutes"),
+    ]
+
+    @staticmethod
+    def remaining_format(due_ts):
+        """
+        Formats the time left until a `to_timestamp` deadline, or the time it
+        is overdue by. "Now" is the reference time, so it is the same for
+        every task rendered in a run.
+        """
+        if DateTime._reference_us is None:
+            DateTime.set_reference_time()
+
+        delta = due_ts * DateTime._US - DateTime._reference_us
         formatted = ""
 
-        for threshold, formatter in resoultion_mapping:
-            if delta > threshold:
-                formatted = formatter(delta)
+        for threshold, unit, fmt in DateTime._REMAINING_FORMAT:
+            if abs(delta) > threshold:
+                formatted = fmt % (abs(delta) // unit)
                 break
 
-        if expired:
-            formatted = "%s late" % formatted
+        if delta < 0:
+            return "%s late" % formatted
         else:
-            formatted = "in %s" % formatted
+            return "in %s" % formatted
 
-        return formatted
+    @staticmethod
+    def deadline_format_remaining(deadline: str):
+        return DateTime.remaining_format(DateTime.timestamp_from_str(deadline))
 
 
-@dataclass
-class Queue:
-    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.json")
-    tasks: dict
-    queue_dir: str = None
-    dump: bool = False  # A flag which defines whether a backup will be saved.
+class ParseCache:
+    """
+    On-disk cache of parsed deadlines stored next to the queue file. Entries
+    are keyed by a hash of the task's text and `VERSION`, so a version bump
+    invalidates the whole cache. Only the deadline timestamp (or `None`) is
+    stored, the header and the details are cheap to take from the text.
+    """
+    CACHE_FILE = ".todocache.json"
 
-    # TODO: backup restore
+    def __init__(self, cache_file, entries=None):
+        self.cache_file = cache_file
+        self.entries = entries if entries is not None else dict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
 
     @staticmethod
-    def load(from_here=False):
-        if not from_here:
-            queue_file = Queue.QUEUE_FILE
-        else:
-            queue_file = str(Path(".").resolve() / "todo.json")
+    def load(queue_dir):
+        cache_file = str(Path(queue_dir) / ParseCache.CACHE_FILE)
 
         try:
-            with open(queue_file, 'r') as f:
-                queue_dir = os.path.dirname(queue_file)
-                q = Queue(json.loads(f.read()), queue_dir=queue_dir)
-
-                if "version" not in q.tasks.keys():
-                    q._sync_task_info(force_update=True)
-                elif q.tasks["version"] != VERSION:
-                    q._sync_task_info(force_update=True)
+            with open(cache_file, 'r') as f:
+                entries = json.loads(f.read())
 
-                return q
+            if type(entries) is not dict:
+                entries = dict()
+        except FileNotFoundError:
+            entries = dict()
         except Exception as e:
-            Log.error(Queue, f"got exception", str(e))
-            return Queue({
-                "todo": [],
-                "done": [],
-                "info": dict(),
-            })
+            Log.warning(ParseCache, "discarding a broken cache", str(e))
+            entries = dict()
 
-    def task_info(self, task):
+        return ParseCache(cache_file, entries)
+
+    @staticmethod
+    def key(task):
+        return hashlib.sha1((VERSION + '\n' + task).encode("utf-8")).hexdigest()
+
+    def get(self, task):
         """
-        Returns a `dict` object w/ the following fields
-        - "header"
-        - "details" (optional)
-        - "due" (optional)
+        Returns the cached deadline timestamp, `None` for a task w/o one.
+        Raises `KeyError` on a miss
         """
-        return self.tasks["info"][task]
+        key = ParseCache.key(task)
+        ret = self.entries.get(key)
 
-    def todo_tasks(self):
-        return self.tasks["todo"]
+        # Entries of other shapes, e.g. whole infos of an older cache, are misses
+        if key not in self.entries or (ret is not None and type(ret) is not int):
+            self.misses += 1
 
-    def done_tasks(self):
-        return self.tasks["done"]
+            raise KeyError(task)
 
-    def _task_get_deadline(self, task):
-        if task not in self.tasks["info"]:
-            return None
+        self.hits += 1
 
-        if "due" not in self.tasks["info"][task]:
-            return None
+        return ret
 
-        return self.tasks["info"][task]["due"]
+    def put(self, task, info):
+        key = ParseCache.key(task)
+        due_ts = info.get("due_ts")
 
-    def _sort(self):
-        self.todo_tasks().sort()
+        if key not in self.entries or self.entries[key] != due_ts:
+            self.entries[key] = due_ts
+            self.dirty = True
 
-        # Partition the list of tasks based on whether a task has a deadline
-        tasks_deadline = list(filter(lambda t: self._task_get_deadline(t) is not None, self.todo_tasks()))
-        tasks_no_deadline = list(filter(lambda t: t not in tasks_deadline, self.todo_tasks()))
-        tasks_deadline.sort(key=lambda t: date_parse(self._task_get_deadline(t)))
-        self.tasks["todo"] = tasks_deadline + tasks_no_deadline
+    def evict(self, tasks):
+        """
+        Drops every entry that does not correspond to any of `tasks`
+        """
+        keys = set(map(ParseCache.key, tasks))
+        stale = [k for k in self.entries.keys() if k not in keys]
 
-    def save(self, here=False):
-        self._sort()
+        for k in stale:
+            self.entries.pop(k)
 
-        if not here:
-            queue_file = Queue.QUEUE_FILE
-        else:
-            queue_file = str(Path(".") / "todo.json")
+        if len(stale):
+            self.dirty = True
 
-        with open(queue_file, 'w') as f:
-            f.write(json.dumps(self.tasks, indent=4))
+    def save(self):
+        if not self.dirty:
+            return
 
-        if self.dump:
-            try:
-                os.mkdir(Path(self.queue_dir) / ".tododump")
-            except Exception:
-                pass
+        try:
+            _file_write_atomic(self.cache_file, json.dumps(self.entries))
+            self.dirty = False
+        except Exception as e:
+            Log.warning(ParseCache, "could not save cache", str(e))
 
-            dump_file_path = str((Path(self.queue_dir) / ".tododump" \
-                / DUMP_DURRENT_TIME).resolve()) \
-                + ".json.gz"
-            with open(dump_file_path, "wb+") as f:
-                output = json.dumps(self.tasks, indent=4)
-                output = output.encode("raw_unicode_escape")
-                output = gzip.compress(output)
-                f.write(output)
+
+class QueueLock:
+    """
+    Advisory lock on a queue directory. It is held from `load()` through
+    `save()`, so concurrent load-modify-save cycles do not lose each other's
+    updates. Acquiring a lock this process already holds is a no-op, the
+    outer one gets released.
+    """
+    LOCK_FILE = ".todo.lock"
+    _held = set()  # Lock files held by this process
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self.fd = None
 
     @staticmethod
-    def _task_parse_info(task):
-        ret = dict()
+    def acquire(queue_dir, blocking=True):
+        """
+        `blocking` - wait for another instance to release the lock, instead
+        of returning `None`
+        """
+        ret = QueueLock(str(Path(queue_dir) / QueueLock.LOCK_FILE))
 
-        Log.debug("parsing info for task", task)
-        deadline = None
+        if fcntl is None or ret.lock_file in QueueLock._held:
+            return ret
 
-        for d in map(lambda d: DateTime.parse_datetime(d), TextFormat.split_multiline(task)):
-            if d is not None:
-                if deadline is None:
-                    deadline = d
-                elif d < deadline:
-                    deadline = d
+        ret.fd = os.open(ret.lock_file, os.O_RDWR | os.O_CREAT, 0o666)
 
-        if deadline:
-            ret["due"] = datetime.datetime.strftime(deadline, TIME_FORMAT)
+        try:
+            fcntl.flock(ret.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not blocking:
+                os.close(ret.fd)
 
-        details = TextFormat.split_first_line(task)
-        ret["header"] = details[0]
-        ret["details"] = ""
+                return None
 
-        if len(details) == 2:
-            ret["details"] = details[1]
+            Log.info(QueueLock, "waiting for another instance to finish")
+            fcntl.flock(ret.fd, fcntl.LOCK_EX)
+
+        QueueLock._held.add(ret.lock_file)
 
         return ret
 
-    def search_and(self, queries, match_case, category="todo"):
-        assert category in ["todo", "done"]
-        if match_case:
-            adjust_case = lambda x: x
-        else:
-            adjust_case = lambda x: x.lower()
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+            QueueLock._held.discard(self.lock_file)
+
+
+class SearchIndex:
+    """
+    Case-insensitive inverted index of the words of tasks. Each word of a
+    query must be a substring of some word of a matching task, so the index
+    narrows a search down to a few candidates, which then get checked w/ a
+    plain substring search. Lowercased tasks are cached for the latter.
+
+    Fuzzy search matches query words against the vocabulary instead, as
+    subsequences, or by trigram similarity to catch typos. The candidate
+    words come from an index of the trigrams of the vocabulary, which is
+    built on the first fuzzy search.
+    """
+    _WORD = re.compile(r"\w+")
+    # fzf-like scores of a query word matched against a word of a task
+    SCORE_MATCH = 16  # Per matched character
+    BONUS_START = 8  # The word starts w/ the query
+    BONUS_CONSECUTIVE = 8  # Per character that follows the previous match
+    PENALTY_GAP = 2  # Per character skipped b/w matches
+    TRIGRAM_SIMILARITY_MIN = 0.3
+
+    def __init__(self):
+        self.lower = dict()  # task -> lowercased task
+        self.postings = dict()  # word -> set of tasks
+        self.trigrams = None  # trigram -> set of words
 
-        queries_check = lambda t: all(map(lambda q: adjust_case(q) in adjust_case(t), queries))
-        map_search_match = map(lambda t: t if queries_check(t) else None, self.tasks[category])
-        map_search_filter = filter(lambda t: t is not None, map_search_match)
+    def add(self, task):
+        if task in self.lower:
+            return
 
-        return list(map_search_filter)
+        lower = task.lower()
+        self.lower[task] = lower
 
-    def undo(self, item):
-        self.dump = True
-        list_remove_item(self.done_tasks(), item)
-        self.todo_tasks().append(item)
-        self._sync_task_info()
+        for word in set(SearchIndex._WORD.findall(lower)):
+            if word not in self.postings:
+                self.postings[word] = set()
+                self._trigrams_add(word)
 
-    def do(self, item):
-        self.dump = True
-        list_remove_item(self.todo_tasks(), item)
-        self.done_tasks().append(item)
-        self._sync_task_info()
+            self.postings[word].add(task)
 
-    def _sync_task_info(self, force_update=False):
-        stall_info = []
-        self.tasks["version"] = VERSION
+    def remove(self, task):
+        lower = self.lower.pop(task, None)
 
-        for k in self.tasks["info"].keys():
-            if k not in self.todo_tasks() and k not in self.done_tasks():
-                stall_info += [k]
+        if lower is None:
+            return
 
-        for si in stall_info:
-            self.tasks["info"].pop(si)
+        for word in set(SearchIndex._WORD.findall(lower)):
+            tasks = self.postings[word]
+            tasks.discard(task)
 
-        for category in ["todo", "done"]:
-            for t in self.tasks[category]:
-                if t not in self.tasks["info"].keys() or force_update:
-                    self.tasks["info"][t] = Queue._task_parse_info(t)
+            if len(tasks) == 0:
+                self.postings.pop(word)
+                self._trigrams_remove(word)
 
-    def add(self, task):
+    def candidates(self, queries):
         """
-        Ensures cohesion b/w `self.todo` and `self.task_info`
+        Returns a superset of the tasks that contain every query, or `None`,
+        if the queries have no words to narrow the search by
         """
-        self.dump = True
-        self.tasks["todo"] += [task]
-        self._sync_task_info()
+        words = set()
 
-    def item_edit(self, items_before, items_after):
-        """
-        Edit/Split item
-        """
-        self.dump = True
-        for item in items_before:
-            list_remove_item(self.todo_tasks(), item)
+        for q in queries:
+            words.update(SearchIndex._WORD.findall(q.lower()))
 
-        self.todo_tasks().extend(list(items_after))
-        self._sync_task_info()
+        ret = None
 
-    def clear_done(self):
-        self.dump = True
-        self.tasks["done"] = []
+        # Longer words are more selective
+        for word in sorted(words, key=len, reverse=True):
+            if ret is None:
+                ret = set()
 
+                for w, tasks in self.postings.items():
+                    if word in w:
+                        ret.update(tasks)
+            else:
+                ret = {t for t in ret if word in self.lower[t]}
 
-class PlainTextQueue(Queue):
-    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.txt")
-    _DONE_MARKER = "@done"
-    _DUE_MARKER = "@due"
+            if len(ret) == 0:
+                break
+
+        return ret
 
     @staticmethod
-    def load(from_here=False):
-        # Select working directory
-        if not from_here:
-            queue_file = PlainTextQueue.QUEUE_FILE
-        else:
-            queue_file = str(Path(".").resolve() / "todo.txt")
+    def word_trigrams(word):
+        padded = "  " + word + " "
 
-        queue_dir = os.path.dirname(queue_file)
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
-        try:
-            with open(queue_file, 'r') as f:
-                tasks = dict()  # Backward-compatible dict-based data structure
-                tasks["done"] = []
-                tasks["todo"] = []
-                tasks["info"] = dict()
-                all_tasks = TextFormat.split_double_multiline(f.read())
-                all_tasks = list(map(lambda s: s.strip(), all_tasks))
-
-                Log.debug("all_tasks", all_tasks)
-                # Separate b/w "todo" and "done" tasks
-                for task in all_tasks:
-                    if PlainTextQueue._DONE_MARKER in task:
-                        tasks["done"].append(task)
-                    else:
-                        tasks["todo"].append(task)
-
-                    tasks["info"][task] = PlainTextQueue._task_parse_info(task)
-
-                ret = PlainTextQueue(tasks=tasks, queue_dir=queue_dir)
-                ret._sync_task_info(force_update=True)
+    def _trigrams_add(self, word):
+        if self.trigrams is not None:
+            for trigram in SearchIndex.word_trigrams(word):
+                self.trigrams.setdefault(trigram, set()).add(word)
 
-                return ret
+    def _trigrams_remove(self, word):
+        if self.trigrams is not None:
+            for trigram in SearchIndex.word_trigrams(word):
+                words = self.trigrams[trigram]
+                words.discard(word)
 
-        except Exception as e:
-            Log.error(PlainTextQueue, "got exception", str(e))
+                if len(words) == 0:
+                    self.trigrams.pop(trigram)
 
-            return PlainTextQueue(
-                tasks={
-                    "todo": [],
-                    "done": [],
-                    "info": dict(),
-                },
-                queue_dir=queue_dir
-            )
+    @staticmethod
+    def subsequence_score(query, word):
+        """
+        Scores `query` as a subsequence of `word`, like fzf does: matched
+        characters, consecutive ones, and a match at the start of the word
+        add to the score, skipped characters subtract from it. `None`, if
+        `query` is not a subsequence of `word`
+        """
+        pos = word.find(query)
 
-    def _sync_task_info(self, force_update=False):
-        stall_info = []
-        self.tasks["version"] = VERSION
+        # A substring beats any scattered match
+        if pos >= 0:
+            return (len(query) * SearchIndex.SCORE_MATCH + (len(query) - 1) * SearchIndex.BONUS_CONSECUTIVE
+                + (SearchIndex.BONUS_START if pos == 0 else 0) - (len(word) - len(query)))
+
+        score = -(len(word) - len(query))
+        prev = -1
 
-        for k in self.tasks["info"].keys():
-            if k not in self.todo_tasks() and k not in self.done_tasks():
-                stall_info += [k]
+        for c in query:
+            pos = word.find(c, prev + 1)
 
-        for si in stall_info:
-            self.tasks["info"].pop(si)
+            if pos < 0:
+                return None
 
-        for category in ["todo", "done"]:
-            for t in self.tasks[category]:
-                if t not in self.tasks["info"].keys() or force_update:
-                    self.tasks["info"][t] = PlainTextQueue._task_parse_info(t)
+            score += SearchIndex.SCORE_MATCH
 
-    def _serialized_task_info(self, task):
+            if pos == 0:
+                score += SearchIndex.BONUS_START
+            elif pos == prev + 1:
+                score += SearchIndex.BONUS_CONSECUTIVE
+            elif prev >= 0:
+                score -= (pos - prev - 1) * SearchIndex.PENALTY_GAP
+
+            prev = pos
+
+        return score
+
+    def _fuzzy_words(self, query):
         """
-        Produces a serialized metainfo for a task
+        Returns `{word: score}` of the words of the vocabulary `query` matches.
+        Only the words that share a trigram w/ the query are considered, so a
+        subsequence should start at the first letter of a word, or keep a
+        few letters of it together.
         """
-        lines = []
-        lines.append(self.tasks["info"][task]["header"])
-        lines.append(self.tasks["info"][task]["details"])
-        due = _dict_try_get_value(self.tasks["info"][task], "due")
+        if self.trigrams is None:
+            self.trigrams = dict()
 
-        if due is not None:
-            lines.append("@due " + str(due))
+            for word in self.postings.keys():
+                self._trigrams_add(word)
 
-        if task in self.tasks["done"]:
-            lines.append("@done")
+        trigrams = SearchIndex.word_trigrams(query)
+        shared = dict()
 
-        lines = list(filter(lambda s: len(s), lines))
+        for trigram in trigrams:
+            for word in self.trigrams.get(trigram, ()):
+                shared[word] = shared.get(word, 0) + 1
 
-        return TextFormat.default_multiline_splitter().join(lines)
+        ret = dict()
 
-    def _as_serialized(self):
-        """
-        Converts the internal data structure into a restorable portable text
-        format
-        """
-        ret = self.todo_tasks() + self.done_tasks()
-        ret = list(map(self._serialized_task_info, ret))
-        multiline_splitter = TextFormat.default_multiline_splitter() * 2
-        ret = multiline_splitter.join(ret)
+        for word, n in shared.items():
+            score = SearchIndex.subsequence_score(query, word)
+            similarity = n / (len(trigrams) + len(SearchIndex.word_trigrams(word)) - n)
+
+            # A typo scores at most half of a subsequence match
+            if similarity >= SearchIndex.TRIGRAM_SIMILARITY_MIN:
+                score_typo = int(similarity * len(query) * SearchIndex.SCORE_MATCH / 2)
+                score = score_typo if score is None else max(score, score_typo)
+
+            if score is not None:
+                ret[word] = score
+
+        return ret
+
+    def fuzzy(self, queries):
+        """
+        Returns `{task: score}` of the tasks in which every query word matches
+        some word, see `_fuzzy_words`. A task scores the sum of the best
+        scores of the query words. `None`, if the queries have no words.
+        """
+        words = dict.fromkeys(w for q in queries for w in SearchIndex._WORD.findall(q.lower()))
+        ret = None
+
+        for query in words:
+            scores = dict()
+
+            for word, score in self._fuzzy_words(query).items():
+                for task in self.postings[word]:
+                    if (ret is None or task in ret) and scores.get(task, score - 1) < score:
+                        scores[task] = score
+
+            ret = scores if ret is None else {t: ret[t] + score for t, score in scores.items()}
+
+            if len(ret) == 0:
+                break
+
+        return ret
+
+
+class Task:
+    """
+    Parsed info of a task. The header and the details are kept as offsets
+    into the task's body, unless they are not its substrings (e.g. the
+    metalines have been stripped off the details). The deadline is kept as
+    a `DateTime.to_timestamp` value.
+
+    Reads like the `dict` info of the previous versions: "header",
+    "details", and, if there is a deadline, "due" and "due_ts".
+    """
+    __slots__ = ("body", "_header_end", "_details_start", "_details_end", "_text", "due_ts", "done")
+
+    def __init__(self, body, header, details, due_ts=None, done=False):
+        self.body = body
+        self.due_ts = due_ts
+        self.done = done
+        self._text = None  # `(header, details)`, if they are not slices of the body
+        self._header_end = len(header)
+        self._details_start = body.find(details, self._header_end) if len(details) else self._header_end
+        self._details_end = self._details_start + len(details)
+
+        if self._details_start < 0 or not body.startswith(header):
+            self._text = (header, details)
+
+    @staticmethod
+    def from_spans(body, header_end, details_start, details_end, due_ts=None, done=False):
+        """
+        Creates a task whose header and details are known slices of its
+        body, w/o searching for them
+        """
+        ret = Task.__new__(Task)
+        ret.body = body
+        ret.due_ts = due_ts
+        ret.done = done
+        ret._text = None
+        ret._header_end = header_end
+        ret._details_start = details_start
+        ret._details_end = details_end
+
+        return ret
+
+    def spans(self):
+        """
+        Returns `(header_end, details_start, details_end)`, or `None`, if the
+        header and the details are not slices of the body
+        """
+        if self._text is not None:
+            return None
+
+        return self._header_end, self._details_start, self._details_end
+
+    @staticmethod
+    def from_info(body, info):
+        """
+        Converts `dict` info, e.g. one stored in "todo.json" or in the parse
+        cache
+        """
+        if info is None or isinstance(info, Task):
+            return info
+
+        due_ts = info.get("due_ts")
+
+        if due_ts is None and info.get("due") is not None:
+            # Info produced by an older version
+            due_ts = DateTime.to_timestamp(DateTime.datetime_from_str(info["due"]).replace(second=0, microsecond=0))
+
+        return Task(body, info.get("header", ""), info.get("details", ""), due_ts)
+
+    @property
+    def header(self):
+        if self._text is not None:
+            return self._text[0]
+
+        return self.body[:self._header_end]
+
+    @property
+    def details(self):
+        if self._text is not None:
+            return self._text[1]
+
+        return self.body[self._details_start:self._details_end]
+
+    @property
+    def due(self):
+        if self.due_ts is None:
+            return None
+
+        return (DateTime.EPOCH + datetime.timedelta(seconds=self.due_ts)).strftime(TIME_FORMAT)
+
+    def keys(self):
+        if self.due_ts is None:
+            return ("header", "details")
+
+        return ("header", "details", "due", "due_ts")
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def as_dict(self):
+        return {k: self[k] for k in self.keys()}
+
+
+class TaskStore:
+    """
+    Storage for "todo" and "done" tasks. Each category is an insertion-ordered
+    `dict` mapping a task onto its `Task` info, and a reverse index maps a task onto
+    its category, so membership, category lookup, and removal are O(1).
+
+    A category may be switched into sorted mode w/ `sort()`. After that, it
+    is kept in order incrementally by bisecting a list of `(key, task)`
+    entries.
+    """
+    CATEGORIES = ("todo", "done")
+
+    def __init__(self):
+        self._tasks = {c: dict() for c in TaskStore.CATEGORIES}
+        self._category = dict()
+        self._sort_key = dict()  # category -> `key(task, info)`
+        self._sorted = dict()  # category -> sorted list of `(key, task)`
+        self._seq = dict()  # task -> counter value at insertion, tells the order of unsorted categories
+        self._seq_next = 0
+        self._index = None  # `SearchIndex`, built on demand
+
+    @staticmethod
+    def from_dict(tasks):
+        """
+        Builds a store from the backward-compatible dict-based data structure:
+        `{"todo": [...], "done": [...], "info": {...}}`
+        """
+        ret = TaskStore()
+        info = tasks.get("info", dict())
+
+        for category in TaskStore.CATEGORIES:
+            for task in tasks.get(category, []):
+                ret.add(task, category, info.get(task))
+
+        return ret
+
+    def as_dict(self):
+        """
+        Produces the backward-compatible dict-based data structure
+        """
+        info = dict()
+
+        # In the order of the lists, so equal stores serialize equally
+        for category in TaskStore.CATEGORIES:
+            for t in self.tasks_iter(category):
+                i = self._tasks[category][t]
+                info[t] = i.as_dict() if i is not None else None
+
+        return {
+            "todo": self.tasks("todo"),
+            "done": self.tasks("done"),
+            "info": info,
+        }
+
+    def __contains__(self, task):
+        return task in self._category
+
+    def __len__(self):
+        return len(self._category)
+
+    def __iter__(self):
+        return iter(self._category)
+
+    def category(self, task):
+        return self._category.get(task)
+
+    def tasks(self, category):
+        return list(self.tasks_iter(category))
+
+    def tasks_iter(self, category):
+        if category in self._sorted:
+            return (t for _, t in self._sorted[category])
+
+        return iter(self._tasks[category].keys())
+
+    def items(self, category):
+        return self._tasks[category].items()
+
+    def info(self, task):
+        return self._tasks[self._category[task]][task]
+
+    def set_info(self, task, info):
+        category = self._category[task]
+        info = Task.from_info(task, info)
+
+        if info is not None:
+            info.done = category == "done"
+
+        self._sorted_remove(category, task)
+        self._tasks[category][task] = info
+        self._sorted_insert(category, task)
+
+    def add(self, task, category="todo", info=None):
+        """
+        Appends a task to the end of a category, or inserts it in order, if
+        the category is sorted. A task that is already stored gets moved, and
+        keeps its info unless a new one is provided. `info` - `Task`, or its
+        `dict` view.
+        """
+        category_prev = self._category.get(task)
+        info = Task.from_info(task, info)
+
+        if category_prev is not None:
+            self._sorted_remove(category_prev, task)
+            info_prev = self._tasks[category_prev].pop(task)
+
+            if info is None:
+                info = info_prev
+
+        elif self._index is not None:
+            self._index.add(task)
+
+        if info is not None:
+            info.done = category == "done"
+
+        self._tasks[category][task] = info
+        self._category[task] = category
+        self._seq[task] = self._seq_next
+        self._seq_next += 1
+        self._sorted_insert(category, task)
+
+    def remove(self, task):
+        category = self._category.get(task)
+
+        if category is not None:
+            self._sorted_remove(category, task)
+            self._category.pop(task)
+            self._seq.pop(task)
+            self._tasks[category].pop(task)
+
+            if self._index is not None:
+                self._index.remove(task)
+
+    def clear(self, category):
+        for task in self._tasks[category].keys():
+            self._category.pop(task)
+            self._seq.pop(task)
+
+            if self._index is not None:
+                self._index.remove(task)
+
+        self._tasks[category] = dict()
+
+        if category in self._sorted:
+            self._sorted[category] = []
+
+    def ordered(self, category, tasks):
+        """
+        Sorts a subset of a category's tasks in the category's order
+        """
+        if category in self._sorted:
+            key = self._sort_key[category]
+
+            return sorted(tasks, key=lambda t: (key(t, self._tasks[category][t]), t))
+
+        return sorted(tasks, key=self._seq.__getitem__)
+
+    def search_index(self):
+        """
+        Builds the search index on the first call, keeps it up to date
+        afterwards
+        """
+        if self._index is None:
+            self._index = SearchIndex()
+
+            for task in self._category.keys():
+                self._index.add(task)
+
+        return self._index
+
+    def sort(self, category, key):
+        """
+        Sorts a category by `key(task, info)`, and keeps it sorted from now
+        on. Ties are resolved by comparing tasks lexicographically.
+        """
+        self._sort_key[category] = key
+        self._sorted[category] = sorted((key(t, i), t) for t, i in self._tasks[category].items())
+
+    def _sorted_insert(self, category, task):
+        if category in self._sorted:
+            entry = (self._sort_key[category](task, self._tasks[category][task]), task)
+            bisect.insort(self._sorted[category], entry)
+
+    def _sorted_remove(self, category, task):
+        if category not in self._sorted:
+            return
+
+        entries = self._sorted[category]
+        entry = (self._sort_key[category](task, self._tasks[category][task]), task)
+        i = bisect.bisect_left(entries, entry)
+
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+        else:
+            # The info has been modified in place, and the key has changed
+            entries[:] = [e for e in entries if e[1] != task]
+
+
+class Journal:
+    """
+    Backup of a queue kept in ".tododump". It consists of an append-only
+    journal of the commands applied to the queue, and of gzipped snapshots
+    which are taken every `SNAPSHOT_PERIOD` commits. Only `SNAPSHOTS_KEEP`
+    latest snapshots are retained, and the journal gets truncated
+    accordingly.
+
+    Every journal entry has a sequence number. A commit entry lists the
+    operations applied by a single `save()`, a snapshot entry refers to a
+    snapshot file. Both store a hash of the queue file they have resulted in,
+    so modifications made outside of the application get detected, and
+    snapshotted before they could break the replay.
+    """
+    DUMP_DIR = ".tododump"
+    JOURNAL_FILE = "journal.jsonl"
+    SNAPSHOT_PERIOD = 50
+    SNAPSHOTS_KEEP = 20
+
+    def __init__(self, queue_dir, dump_suffix):
+        self.dump_dir = Path(queue_dir) / Journal.DUMP_DIR
+        self.journal_file = self.dump_dir / Journal.JOURNAL_FILE
+        self.dump_suffix = dump_suffix
+
+    @staticmethod
+    def _hash(serialized):
+        return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _time():
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def entries(self):
+        ret = []
+
+        try:
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        ret.append(json.loads(line))
+                    except ValueError:
+                        # An interrupted append
+                        Log.warning(Journal, "skipping a broken entry")
+        except FileNotFoundError:
+            pass
+
+        return ret
+
+    def _append(self, entries):
+        with open(self.journal_file, 'a') as f:
+            Trace.count("bytes written", f.write("".join(json.dumps(e) + '\n' for e in entries)))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _snapshot(self, seq, serialized):
+        import gzip
+
+        snapshot_file = "%s-%d%s" % (DUMP_DURRENT_TIME, seq, self.dump_suffix)
+
+        with Trace.phase("gzip"):
+            output = gzip.compress(serialized.encode("utf-8"))
+
+        _file_write_atomic(str(self.dump_dir / snapshot_file), output, "wb")
+
+        return {"seq": seq, "time": Journal._time(), "snapshot": snapshot_file, "hash": Journal._hash(serialized)}
+
+    def commit(self, ops, serialized, serialized_prev, snapshot=False):
+        """
+        Journals the operations which have turned `serialized_prev` into
+        `serialized`. `serialized_prev` is `None`, if there was no queue file.
+        """
+        try:
+            os.mkdir(self.dump_dir)
+        except FileExistsError:
+            pass
+
+        entries = self.entries()
+        seq = entries[-1]["seq"] + 1 if len(entries) else 1
+        appended = []
+
+        # The journal may only be replayed on top of the content it has
+        # produced
+        if len(entries) == 0 or entries[-1]["hash"] != Journal._hash(serialized_prev or ""):
+            if serialized_prev is None:
+                snapshot = True
+            else:
+                appended.append(self._snapshot(seq, serialized_prev))
+                seq += 1
+
+        commit = {"seq": seq, "time": Journal._time(), "ops": ops, "hash": Journal._hash(serialized)}
+
+        # Relative dates of the added tasks have been resolved against it
+        if DateTime._reference_time is not None:
+            commit["reference_time"] = DateTime._reference_time.isoformat()
+
+        appended.append(commit)
+        commits = 0
+
+        for e in reversed(entries + appended):
+            if "snapshot" in e:
+                break
+
+            commits += 1
+
+        if snapshot or commits >= Journal.SNAPSHOT_PERIOD:
+            appended.append(self._snapshot(seq + 1, serialized))
+
+        self._append(appended)
+
+        if "snapshot" in appended[-1]:
+            self._compact(entries + appended)
+
+    def _compact(self, entries):
+        """
+        Removes the snapshots which are out of retention along w/ the journal
+        entries which can no longer be replayed
+        """
+        snapshots = [e for e in entries if "snapshot" in e]
+
+        if len(snapshots) <= Journal.SNAPSHOTS_KEEP:
+            return
+
+        seq_first = snapshots[-Journal.SNAPSHOTS_KEEP]["seq"]
+
+        for e in snapshots[:-Journal.SNAPSHOTS_KEEP]:
+            try:
+                os.remove(self.dump_dir / e["snapshot"])
+            except FileNotFoundError:
+                pass
+
+        entries = [e for e in entries if e["seq"] >= seq_first]
+        _file_write_atomic(str(self.journal_file), "".join(json.dumps(e) + '\n' for e in entries))
+
+    def points(self):
+        """
+        Lists the points a queue can be restored to, the latest first. Full
+        dumps made by older versions are listed too.
+        """
+        entries = self.entries()
+        ret = []
+        seq_base = None
+
+        for e in entries:
+            if "snapshot" in e:
+                seq_base = e["seq"]
+                ret.append(e)
+            elif seq_base is not None:
+                ret.append(e)
+
+        ret.reverse()
+        legacy = sorted(self.dump_dir.glob("[0-9]" * len(DUMP_DURRENT_TIME) + self.dump_suffix), reverse=True)
+        ret += [{"legacy": p.name} for p in legacy]
+
+        return ret
+
+    @staticmethod
+    def _snapshot_read(snapshot_file, encoding):
+        import gzip
+
+        with open(snapshot_file, "rb") as f:
+            return gzip.decompress(f.read()).decode(encoding)
+
+    def restore(self, point, queue):
+        """
+        Reconstructs the state at a point returned by `points()`, `queue` is
+        used as a prototype. Returns a queue of the same type.
+        """
+        if "legacy" in point:
+            # Full dumps made by older versions
+            serialized = Journal._snapshot_read(self.dump_dir / point["legacy"], "raw_unicode_escape")
+
+            return queue._from_serialized(serialized)
+
+        entries = [e for e in self.entries() if e["seq"] <= point["seq"]]
+        base = max(i for i, e in enumerate(entries) if "snapshot" in e)
+        serialized = Journal._snapshot_read(self.dump_dir / entries[base]["snapshot"], "utf-8")
+        ret = queue._from_serialized(serialized)
+        ret.cache = None  # Must not mirror the states being replayed
+        reference_time = DateTime._reference_time
+
+        try:
+            for e in entries[base + 1:]:
+                DateTime.set_reference_time(datetime.datetime.fromisoformat(e.get("reference_time", e["time"])))
+
+                # The ops refer to the tasks as they are read back from the queue file
+                for op in e["ops"]:
+                    ret._replay([op])
+                    ret = ret._reread()
+
+                if Journal._hash(ret._as_serialized()) != e["hash"]:
+                    raise ValueError("replaying entry %d has not reproduced the queue it was journaled for" % e["seq"])
+        finally:
+            DateTime.set_reference_time(reference_time)
+
+        return ret
+
+
+@dataclass
+class Queue:
+    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.json")
+    store: TaskStore
+    queue_dir: str = None
+    dump: bool = False  # A flag which defines whether a backup will be saved.
+    ops: list = field(default_factory=list)  # Operations to be journaled on save
+    DUMP_SUFFIX = ".json.gz"
+    dirty: bool = False  # Whether the queue has been modified since it was loaded
+    cache: ParseCache = None  # Parsed info of the tasks as they are stored on disk
+    lock: QueueLock = None  # Held until the queue is saved
+    PARSE_POOL_MIN = 1000  # Below that, starting a process pool costs more than it saves
+    PARSE_POOL_CHUNK = 250
+    FUZZY_TOP = 20  # Matches a fuzzy search shows, unless `--limit` is given
+
+    def __post_init__(self):
+        with Trace.phase("sort"):
+            self.store.sort("todo", Queue._task_sort_key)
+
+    @staticmethod
+    def load(from_here=False, lock=False):
+        """
+        `lock` - take an advisory lock which is held until `save()`. Should be
+        set when the queue is going to be modified.
+        """
+        if not from_here:
+            queue_file = Queue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".").resolve() / "todo.json")
+
+        queue_dir = os.path.dirname(queue_file)
+        queue_lock = QueueLock.acquire(queue_dir) if lock else None
+
+        try:
+            with open(queue_file, 'r') as f:
+                q = Queue._parse(f.read(), queue_dir)
+                q.lock = queue_lock
+
+                return q
+        except Exception as e:
+            Log.error(Queue, f"got exception", str(e))
+            return Queue(TaskStore(), queue_dir=queue_dir, lock=queue_lock)
+
+    @staticmethod
+    def _parse(serialized, queue_dir, cache=None):
+        tasks = json.loads(serialized)
+        q = Queue(TaskStore.from_dict(tasks), queue_dir=queue_dir)
+
+        with Trace.phase("_sync_task_info"):
+            if "version" not in tasks.keys():
+                q._sync_task_info(force_update=True)
+            elif tasks["version"] != VERSION:
+                q._sync_task_info(force_update=True)
+            else:
+                q._sync_task_info()
+
+        return q
+
+    def _from_serialized(self, serialized):
+        """
+        Creates a new queue of the same type in the same directory
+        """
+        return type(self)._parse(serialized, self.queue_dir, self.cache)
+
+    def _reread(self):
+        """
+        Returns the queue the way it would be restored from a snapshot
+        """
+        return self._from_serialized(self._as_serialized())
+
+    def task_info(self, task):
+        """
+        Returns a `Task`, which reads like a `dict` w/ the following fields
+        - "header"
+        - "details" (optional)
+        - "due" (optional)
+        """
+        return self.store.info(task)
+
+    def todo_tasks(self):
+        return self.store.tasks("todo")
+
+    def done_tasks(self):
+        return self.store.tasks("done")
+
+    def tasks_iter(self, category):
+        return self.store.tasks_iter(category)
+
+    @staticmethod
+    def _task_sort_key(task, info):
+        """
+        Tasks w/ deadlines go first, the earliest one on top. The rest is
+        sorted lexicographically.
+        """
+        if info is None or info.due_ts is None:
+            return (1, 0)
+
+        return (0, info.due_ts)
+
+    def _mark_modified(self):
+        self.dirty = True
+        self.dump = True
+
+    @staticmethod
+    def _read_if_exists(queue_file):
+        try:
+            with open(queue_file, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, queue_file, serialized):
+        """
+        Writes the queue file, unless it already has the exact same content,
+        and journals the changes
+        """
+        serialized_prev = Queue._read_if_exists(queue_file)
+
+        if serialized == serialized_prev:
+            return
+
+        _file_write_atomic(queue_file, serialized)
+
+        if self.dump:
+            self._journal_commit(serialized, serialized_prev)
+
+    def _journal_commit(self, serialized, serialized_prev):
+        # The operations that replace the whole queue can not be replayed
+        snapshot = len(self.ops) and self.ops[-1][0] in ["restore", "import"]
+
+        with Trace.phase("journal"):
+            Journal(self.queue_dir, self.DUMP_SUFFIX).commit(self.ops, serialized, serialized_prev, snapshot)
+
+        self.ops = []
+        self.dump = False
+
+    def _replay(self, ops):
+        for op in ops:
+            if op[0] == "add":
+                self.add(op[1])
+            elif op[0] == "do":
+                self.do(op[1])
+            elif op[0] == "undo":
+                self.undo(op[1])
+            elif op[0] == "edit":
+                self.item_edit(op[1], op[2])
+            elif op[0] == "clear":
+                self.clear_done()
+
+    def backup_points(self):
+        return Journal(self.queue_dir, self.DUMP_SUFFIX).points()
+
+    def restore(self, point):
+        """
+        Rolls the queue back to a point returned by `backup_points()`
+        """
+        restored = Journal(self.queue_dir, self.DUMP_SUFFIX).restore(point, self)
+        self.store = restored.store
+        self._mark_modified()
+        self.ops.append(["restore", point.get("seq")])
+
+    def export_text(self, queue_file):
+        """
+        Writes the queue in the "todo.txt" format
+        """
+        _file_write_atomic(queue_file, PlainTextQueue(self.store, queue_dir=self.queue_dir)._as_serialized())
+
+    def import_text(self, queue_file):
+        """
+        Replaces the queue w/ the content of a "todo.txt" file
+        """
+        with open(queue_file, 'r') as f:
+            self.store = PlainTextQueue._parse(f, self.queue_dir).store
+
+        self._mark_modified()
+        self.ops.append(["import"])
+
+    def _release_lock(self):
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+
+    def _as_dict(self):
+        ret = self.store.as_dict()
+        ret["version"] = VERSION
+
+        return ret
+
+    def close(self):
+        """
+        Releases what a loaded queue holds besides the lock, e.g. a database
+        connection. The queue may not be used afterwards.
+        """
+        pass
+
+    def save(self, here=False):
+        try:
+            # Loaded w/o the lock, but modified anyway, e.g. migrated or re-parsed after a version bump
+            if self.dirty and self.lock is None and self.queue_dir is not None:
+                self.lock = QueueLock.acquire(self.queue_dir)
+
+            self._save(here)
+        finally:
+            self._release_lock()
+
+    def _save(self, here):
+        if not self.dirty:
+            return
+
+        if not here:
+            queue_file = Queue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".") / "todo.json")
+
+        serialized = self._as_serialized()
+        self.dirty = False
+        self._write(queue_file, serialized)
+
+    def _as_serialized(self):
+        return json.dumps(self._as_dict(), indent=4)
+
+    @staticmethod
+    def _task_parse_info(task):
+        ret = dict()
+
+        Log.debug("parsing info for task", task)
+        deadline = None
+
+        for d in map(lambda d: DateTime.parse_datetime(d), TextFormat.split_multiline(task)):
+            if d is not None:
+                if deadline is None:
+                    deadline = d
+                elif d < deadline:
+                    deadline = d
+
+        if deadline:
+            ret["due"] = datetime.datetime.strftime(deadline, TIME_FORMAT)
+            ret["due_ts"] = DateTime.to_timestamp(deadline.replace(second=0, microsecond=0))
+
+        details = TextFormat.split_first_line(task)
+        ret["header"] = details[0]
+        ret["details"] = ""
+
+        if len(details) == 2:
+            ret["details"] = details[1]
+
+        return ret
+
+    @staticmethod
+    def _task_parse_info_many(tasks, parse_info):
+        """
+        Applies `parse_info` to a list of tasks, returns the infos in the same
+        order. Batches of at least `PARSE_POOL_MIN` tasks, like a queue w/o a
+        parse cache, get parsed in a process pool. The workers resolve
+        relative dates against the reference time of this process.
+        """
+        # CPUs this process may run on
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+        if len(tasks) < Queue.PARSE_POOL_MIN or cpus < 2:
+            return list(map(parse_info, tasks))
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        if DateTime._reference_time is None:
+            DateTime.set_reference_time()
+
+        try:
+            with ProcessPoolExecutor(max_workers=cpus, initializer=DateTime.set_reference_time,
+                    initargs=(DateTime._reference_time,)) as executor:
+                # `map` yields the results in the order of `tasks`
+                ret = list(executor.map(parse_info, tasks, chunksize=Queue.PARSE_POOL_CHUNK))
+        except (OSError, RuntimeError) as e:  # E.g. no semaphores in a sandbox, or a worker got killed
+            Log.warning(Queue, "parsing w/o a process pool", str(e))
+
+            return list(map(parse_info, tasks))
+
+        Trace.count("tasks parsed in a pool", len(tasks))
+
+        return ret
+
+    def search_and(self, queries, match_case, category="todo"):
+        assert category in ["todo", "done"]
+        index = self.store.search_index()
+        candidates = index.candidates(queries)
+
+        if match_case:
+            queries_check = lambda t: all(map(lambda q: q in t, queries))
+        else:
+            queries = list(map(str.lower, queries))
+            queries_check = lambda t: all(map(lambda q: q in index.lower[t], queries))
+
+        if candidates is None:
+            return list(filter(queries_check, self.store.tasks_iter(category)))
+
+        matches = [t for t in candidates if self.store.category(t) == category and queries_check(t)]
+
+        return self.store.ordered(category, matches)
+
+    def search_fuzzy(self, queries, category="todo", top=None):
+        """
+        Ranks the tasks that fuzzily match the queries, see
+        `SearchIndex.fuzzy`. Returns the best `top` ones (`FUZZY_TOP` by
+        default), best first. Of the equally scored, shorter tasks go first,
+        then the tasks in alphabetical order.
+        """
+        assert category in ["todo", "done"]
+        top = top or Queue.FUZZY_TOP
+        scores = self.store.search_index().fuzzy(queries)
+
+        # Nothing to rank by
+        if scores is None:
+            return self.search_and(queries, False, category)[:top]
+
+        matches = (t for t in scores.keys() if self.store.category(t) == category)
+
+        return heapq.nsmallest(top, matches, key=lambda t: (-scores[t], len(t), t))
+
+    def _task_add(self, task, category):
+        """
+        Moves a task into a category, parses info for the tasks that are new
+        """
+        if task in self.store:
+            self.store.add(task, category)
+        else:
+            self.store.add(task, category, self._task_parse_info(task))
+
+    def _journal_key(self, task):
+        """
+        Tells how to refer to a task in the journal. The tasks are restored
+        from the queue file, so it is their text there.
+        """
+        return task
+
+    def undo(self, item):
+        self._mark_modified()
+        self.ops.append(["undo", self._journal_key(item)])
+        self._task_add(item, "todo")
+
+    def do(self, item):
+        self._mark_modified()
+        self.ops.append(["do", self._journal_key(item)])
+        self._task_add(item, "done")
+
+    def _sync_task_info(self, force_update=False):
+        """
+        Parses info for the tasks that lack it, or for every task, if
+        `force_update` is set
+        """
+        for category in TaskStore.CATEGORIES:
+            tasks = [t for t, info in self.store.items(category) if info is None or force_update]
+
+            for t, info in zip(tasks, Queue._task_parse_info_many(tasks, self._task_parse_info)):
+                self.store.set_info(t, info)
+                self.dirty = True
+
+    def add(self, task):
+        """
+        Ensures cohesion b/w `self.todo` and `self.task_info`
+        """
+        self._mark_modified()
+        self.ops.append(["add", task])
+        self._task_add(task, "todo")
+
+    def item_edit(self, items_before, items_after):
+        """
+        Edit/Split item
+        """
+        self._mark_modified()
+        self.ops.append(["edit", list(map(self._journal_key, items_before)), list(items_after)])
+        info_before = dict()
+
+        for item in items_before:
+            info_before[item] = self.store.info(item)
+            self.store.remove(item)
+
+        # Items left intact keep their info, and their deadlines
+        for item in items_after:
+            if item in info_before and item not in self.store:
+                self.store.add(item, "todo", info_before[item])
+            else:
+                self._task_add(item, "todo")
+
+    def clear_done(self):
+        self._mark_modified()
+        self.ops.append(["clear"])
+        self.store.clear("done")
+
+
+class PlainTextQueue(Queue):
+    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.txt")
+    DUMP_SUFFIX = ".txt.gz"
+    _DONE_MARKER = "@done"
+    _DUE_MARKER = "@due"
+
+    @staticmethod
+    def load(from_here=False, lock=False):
+        # Select working directory
+        if not from_here:
+            queue_file = PlainTextQueue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".").resolve() / "todo.txt")
+
+        queue_dir = os.path.dirname(queue_file)
+        queue_lock = QueueLock.acquire(queue_dir) if lock else None
+        cache = ParseCache.load(queue_dir)
+
+        try:
+            with open(queue_file, 'r') as f:
+                with Trace.phase("parse"):
+                    ret = PlainTextQueue._parse(f, queue_dir, cache)
+
+                ret.lock = queue_lock
+                Trace.count("parse cache hits", cache.hits)
+                Trace.count("parse cache misses", cache.misses)
+                cache.evict(ret.store)
+                cache.save()
+
+                return ret
+
+        except Exception as e:
+            Log.error(PlainTextQueue, "got exception", str(e))
+
+            return PlainTextQueue(TaskStore(), queue_dir=queue_dir, cache=cache, lock=queue_lock)
+
+    @staticmethod
+    def _parse(serialized, queue_dir, cache=None, known=None):
+        """
+        `serialized` - text, or an iterable of lines, e.g. the queue file.
+        `known` - store to take the info of the tasks it already has from
+        """
+        store = TaskStore()
+        blocks = []
+        missing = []
+
+        for task in TextFormat.iter_blocks(serialized):
+            info = None
+
+            if known is not None and task in known:
+                info = known.info(task)
+            elif cache is not None:
+                try:
+                    info = dict(PlainTextQueue._task_parse_details(task), due_ts=cache.get(task))
+                except KeyError:
+                    pass
+
+            if info is None:
+                missing.append(task)
+
+            blocks.append((task, info))
+
+        # Deadlines have already been parsed, unless the file was edited by hand
+        parsed = dict(zip(missing, Queue._task_parse_info_many(missing,
+            functools.partial(PlainTextQueue._task_parse_info, trust_due=True))))
+
+        for task, info in blocks:
+            if info is None:
+                info = parsed[task]
+
+                if cache is not None:
+                    cache.put(task, info)
+
+            # Separate b/w "todo" and "done" tasks
+            if PlainTextQueue._DONE_MARKER in task:
+                store.add(task, "done", info)
+            else:
+                store.add(task, "todo", info)
+
+        return PlainTextQueue(store, queue_dir=queue_dir, cache=cache)
+
+    def _journal_key(self, task):
+        """
+        A task added by this process is stored under its text as typed, but
+        gets read back w/ the metalines
+        """
+        if task not in self.store:
+            return task
+
+        return self._serialized_task_info(task)
+
+    def _serialized_task_info(self, task):
+        """
+        Produces a serialized metainfo for a task
+        """
+        info = self.store.info(task)
+        lines = []
+        lines.append(info["header"])
+        lines.append(info["details"])
+        due = _dict_try_get_value(info, "due")
+
+        if due is not None:
+            lines.append("@due " + str(due))
+
+        if self.store.category(task) == "done":
+            lines.append("@done")
+
+        lines = list(filter(lambda s: len(s), lines))
+
+        return TextFormat.default_multiline_splitter().join(lines)
+
+    def _as_serialized(self):
+        """
+        Converts the internal data structure into a restorable portable text
+        format
+        """
+        ret = self.todo_tasks() + self.done_tasks()
+        serialized = list(map(self._serialized_task_info, ret))
+
+        # Tasks will be read back in their serialized form, so the cache
+        # should mirror it
+        if self.cache is not None:
+            for task, task_serialized in zip(ret, serialized):
+                self.cache.put(task_serialized, self.store.info(task))
+
+            self.cache.evict(serialized)
+
+        multiline_splitter = TextFormat.default_multiline_splitter() * 2
+        ret = multiline_splitter.join(serialized)
 
         return ret
 
@@ -603,91 +2006,600 @@ class PlainTextQueue(Queue):
             return PlainTextQueue._DUE_MARKER in metaline_candidate \
                 or PlainTextQueue._DONE_MARKER in metaline_candidate
 
-        ret = dict()
-        details = TextFormat.split_first_line(task)
-        ret["header"] = details[0]
-        ret["details"] = ""
+        ret = dict()
+        details = TextFormat.split_first_line(task)
+        ret["header"] = details[0]
+        ret["details"] = ""
+
+        if len(details) == 2 and len(details[1]) > 0:
+            # Strip off metainfo
+
+            ret["details"] = TextFormat.default_multiline_splitter().join(
+                filter(
+                    lambda l: not is_metaline(l),
+                    TextFormat.split_multiline(details[1])
+                )
+            )
+
+        return ret
+
+    @staticmethod
+    def _task_parse_due_date(task, trust_due=False):
+        """
+        Extracts due date from a text string. `trust_due` - take the deadline
+        from the "@due" line, if there is one. Should be set for the tasks
+        that are read back from the queue file, so relative dates, e.g. "in 2
+        hours", stay anchored to the time the task was added.
+        """
+        ret = dict()
+        deadline = None
+        lines = TextFormat.split_multiline(task)
+
+        if trust_due:
+            for line in lines:
+                if line.startswith(PlainTextQueue._DUE_MARKER):
+                    try:
+                        deadline = DateTime.datetime_from_str(line[len(PlainTextQueue._DUE_MARKER):].strip())
+                    except (ValueError, OverflowError):
+                        Log.warning(PlainTextQueue, "malformed deadline", line)
+
+                    break
+
+        for line in lines if deadline is None else []:
+            if line.startswith(PlainTextQueue._DUE_MARKER):
+                break
+
+            deadline_candidate = DateTime.parse_datetime(line)
+
+            if deadline_candidate is not None:
+                if deadline is None:
+                    deadline = deadline_candidate
+                elif deadline_candidate < deadline:
+                    deadline = deadline_candidate
+
+        if deadline is not None:
+            ret["due"] = datetime.datetime.strftime(deadline, TIME_FORMAT)
+            ret["due_ts"] = DateTime.to_timestamp(deadline.replace(second=0, microsecond=0))
+
+        return ret
+
+    @staticmethod
+    def _task_parse_info(task, trust_due=False):
+        details = PlainTextQueue._task_parse_details(task)
+        due = PlainTextQueue._task_parse_due_date(task, trust_due)
+
+        return dict(
+            **details,
+            **due
+        )
+
+    def _save(self, here):
+        if not self.dirty:
+            return
+
+        if not here:
+            queue_file = PlainTextQueue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".") / "todo.txt")
+
+        serialized = self._as_serialized()
+        self.dirty = False
+
+        if self.cache is not None:
+            self.cache.save()
+
+        self._write(queue_file, serialized)
+
+
+class BinaryQueue(PlainTextQueue):
+    """
+    Keeps the queue in a compact binary snapshot, so it gets loaded w/o
+    splitting and parsing the tasks. All the offsets are in code points of
+    the blob.
+
+    - header: magic, format version, number of tasks, blob size in bytes
+    - int64 deadlines (`DateTime.to_timestamp`, `_NO_DUE` if there is none)
+    - uint32 offsets, 6 per task: body, header, and details start and end
+    - uint8 flags (`_FLAG_DONE`)
+    - UTF-8 blob: task bodies, followed by the headers and details which are
+      not slices of their bodies
+
+    "todo.txt" remains the format to sync through w/ `export` and `import`.
+    Backups in ".tododump" are kept in it as well.
+    """
+    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.bin")
+    _MAGIC = b"TODOBIN\0"
+    _FORMAT_VERSION = 1
+    _HEADER = "<8sIII"  # `struct` format
+    _NO_DUE = -2 ** 63
+    _FLAG_DONE = 1
+
+    @staticmethod
+    def load(from_here=False, lock=False):
+        import mmap
+
+        if not from_here:
+            queue_file = BinaryQueue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".").resolve() / "todo.bin")
+
+        queue_dir = os.path.dirname(queue_file)
+        queue_lock = QueueLock.acquire(queue_dir) if lock else None
+
+        try:
+            with open(queue_file, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    ret = BinaryQueue(TaskStore(), queue_dir=queue_dir)
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        ret = BinaryQueue._parse_binary(mm, queue_dir)
+        except FileNotFoundError:
+            ret = BinaryQueue(TaskStore(), queue_dir=queue_dir)
+            text_file = str(Path(queue_dir) / "todo.txt")
+
+            # First run, migrate
+            if os.path.exists(text_file):
+                ret.import_text(text_file)
+        except Exception as e:
+            Log.error(BinaryQueue, "got exception", str(e))
+            ret = BinaryQueue(TaskStore(), queue_dir=queue_dir)
+
+        ret.lock = queue_lock
+
+        return ret
+
+    @staticmethod
+    def _parse_binary(buffer, queue_dir):
+        """
+        `buffer` - `bytes`, or a memory-mapped file
+        """
+        import struct
+
+        store = TaskStore()
+        magic, version, n, blob_size = struct.unpack_from(BinaryQueue._HEADER, buffer)
+
+        if magic != BinaryQueue._MAGIC or version != BinaryQueue._FORMAT_VERSION:
+            raise ValueError("not a queue snapshot, or an unsupported version")
+
+        offset = struct.calcsize(BinaryQueue._HEADER)
+        due = BinaryQueue._array_read(buffer, offset, 'q', n)
+        offset += due.itemsize * n
+        spans = BinaryQueue._array_read(buffer, offset, 'I', 6 * n)
+        offset += spans.itemsize * 6 * n
+        flags = buffer[offset:offset + n]
+        offset += n
+        blob = str(buffer[offset:offset + blob_size], "utf-8")
+
+        for i in range(n):
+            body_start, body_end, header_start, header_end, details_start, details_end = spans[6 * i:6 * i + 6]
+            body = blob[body_start:body_end]
+            due_ts = due[i] if due[i] != BinaryQueue._NO_DUE else None
+            done = bool(flags[i] & BinaryQueue._FLAG_DONE)
+
+            if header_start == body_start and body_start <= details_start <= details_end <= body_end:
+                task = Task.from_spans(body, header_end - body_start, details_start - body_start,
+                    details_end - body_start, due_ts)
+            else:
+                task = Task(body, blob[header_start:header_end], blob[details_start:details_end], due_ts)
+
+            store.add(body, "done" if done else "todo", task)
+
+        return BinaryQueue(store, queue_dir=queue_dir)
+
+    @staticmethod
+    def _array_read(buffer, offset, typecode, n):
+        import array
+
+        ret = array.array(typecode)
+        ret.frombytes(buffer[offset:offset + ret.itemsize * n])
+
+        if sys.byteorder != "little":
+            ret.byteswap()
+
+        return ret
+
+    def _as_binary(self):
+        import array
+        import struct
+
+        tasks = self.todo_tasks() + self.done_tasks()
+        due = array.array('q')
+        spans = array.array('I')
+        flags = bytearray()
+        blob = []
+        blob_extra = []
+        position = 0
+        position_extra = sum(map(len, tasks))
+
+        for task in tasks:
+            info = self.store.info(task)
+            task_spans = info.spans()
+            blob.append(task)
+
+            if task_spans is not None:
+                header_end, details_start, details_end = task_spans
+                spans.extend([position, position + len(task), position, position + header_end,
+                    position + details_start, position + details_end])
+            else:
+                header, details = info.header, info.details
+                spans.extend([position, position + len(task), position_extra, position_extra + len(header),
+                    position_extra + len(header), position_extra + len(header) + len(details)])
+                blob_extra += [header, details]
+                position_extra += len(header) + len(details)
+
+            position += len(task)
+            due.append(info.due_ts if info.due_ts is not None else BinaryQueue._NO_DUE)
+            flags.append(BinaryQueue._FLAG_DONE if info.done else 0)
+
+        if sys.byteorder != "little":
+            due.byteswap()
+            spans.byteswap()
+
+        blob = "".join(blob + blob_extra).encode("utf-8")
+        header = struct.pack(BinaryQueue._HEADER, BinaryQueue._MAGIC, BinaryQueue._FORMAT_VERSION, len(tasks),
+            len(blob))
+
+        return b"".join([header, due.tobytes(), spans.tobytes(), bytes(flags), blob])
+
+    def _from_serialized(self, serialized):
+        """
+        Backups are stored in the "todo.txt" format
+        """
+        return BinaryQueue(PlainTextQueue._parse(serialized, self.queue_dir).store, queue_dir=self.queue_dir)
+
+    def _save(self, here):
+        if not self.dirty:
+            return
+
+        if not here:
+            queue_file = BinaryQueue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".") / "todo.bin")
+
+        data = self._as_binary()
+        self.dirty = False
+
+        try:
+            with open(queue_file, "rb") as f:
+                data_prev = f.read()
+        except FileNotFoundError:
+            data_prev = None
+
+        if data == data_prev:
+            return
+
+        _file_write_atomic(queue_file, data, "wb")
+
+        if self.dump:
+            import struct
+
+            # Backups are kept in the "todo.txt" format, so they stay portable
+            serialized_prev = None
+
+            try:
+                if data_prev is not None:
+                    serialized_prev = BinaryQueue._parse_binary(data_prev, self.queue_dir)._as_serialized()
+            except (ValueError, struct.error) as e:
+                Log.warning(BinaryQueue, "could not read the previous snapshot", str(e))
+
+            self._journal_commit(self._as_serialized(), serialized_prev)
+
+
+class SqliteTaskStore:
+    """
+    `TaskStore` interface over the "tasks" table of `SqliteQueue`. Rows are
+    read on demand, the info of the ones that have been read is kept in
+    memory. The row id tells the order in which the tasks were added, so a
+    task moved b/w categories gets re-inserted.
+
+    Modifications are made in the current transaction, `SqliteQueue.save()`
+    commits them.
+    """
+    _ORDER = {
+        "todo": "ORDER BY due_ts IS NULL, due_ts, body",  # Same as `Queue._task_sort_key`
+        "done": "ORDER BY id",
+    }
+
+    def __init__(self, db):
+        self.db = db
+        self._info = dict()  # task -> `Task`
+        self._index = None
+
+    def _row(self, task):
+        ret = self._info.get(task)
+
+        if ret is None:
+            row = self.db.execute("SELECT body, header, details, due_ts, done FROM tasks WHERE body = ?",
+                (task,)).fetchone()
+
+            if row is not None:
+                ret = self._task_cache(row)
+
+        return ret
+
+    def _task_cache(self, row):
+        body, header, details, due_ts, done = row
+        ret = Task(body, header, details, due_ts, bool(done))
+        self._info[body] = ret
+
+        return ret
+
+    def select(self, category, where="", params=()):
+        """
+        Lazily yields the tasks of a category that satisfy a `WHERE` clause
+        in the category's order
+        """
+        rows = self.db.execute("SELECT body, header, details, due_ts, done FROM tasks WHERE done = ? "
+            + where + " " + SqliteTaskStore._ORDER[category], (category == "done",) + tuple(params))
+
+        for row in rows:
+            yield self._task_cache(row).body
+
+    def as_dict(self):
+        return {
+            "todo": self.tasks("todo"),
+            "done": self.tasks("done"),
+            "info": {t: self.info(t).as_dict() for t in self},
+        }
+
+    def __contains__(self, task):
+        return self._row(task) is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM tasks").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.db.execute("SELECT body FROM tasks"))
+
+    def category(self, task):
+        info = self._row(task)
+
+        if info is None:
+            return None
+
+        return "done" if info.done else "todo"
+
+    def tasks(self, category):
+        return list(self.tasks_iter(category))
 
-        if len(details) == 2 and len(details[1]) > 0:
-            # Strip off metainfo
+    def tasks_iter(self, category):
+        return self.select(category)
 
-            ret["details"] = TextFormat.default_multiline_splitter().join(
-                filter(
-                    lambda l: not is_metaline(l),
-                    TextFormat.split_multiline(details[1])
-                )
-            )
+    def items(self, category):
+        return [(t, self._info[t]) for t in self.tasks_iter(category)]
+
+    def info(self, task):
+        ret = self._row(task)
+
+        if ret is None:
+            raise KeyError(task)
 
         return ret
 
-    @staticmethod
-    def _task_parse_due_date(task):
+    def set_info(self, task, info):
+        self.add(task, self.category(task), info)
+
+    def add(self, task, category="todo", info=None):
+        info = Task.from_info(task, info)
+        info_prev = self._row(task)
+
+        if info_prev is not None:
+            self.remove(task)
+
+            if info is None:
+                info = info_prev
+
+        info.done = category == "done"
+        self.db.execute("INSERT INTO tasks (body, header, details, due_ts, done) VALUES (?, ?, ?, ?, ?)",
+            (task, info.header, info.details, info.due_ts, info.done))
+        self._info[task] = info
+
+        if self._index is not None:
+            self._index.add(task)
+
+    def remove(self, task):
+        self.db.execute("DELETE FROM tasks WHERE body = ?", (task,))
+        self._info.pop(task, None)
+
+        if self._index is not None:
+            self._index.remove(task)
+
+    def clear(self, category):
+        if self._index is not None:
+            for task in self.select(category):
+                self._index.remove(task)
+
+        self.db.execute("DELETE FROM tasks WHERE done = ?", (category == "done",))
+        self._info = {t: i for t, i in self._info.items() if i.done != (category == "done")}
+
+    def search_index(self):
         """
-        Extracts due date from a text string
+        Reads every task on the first call. Only fuzzy search needs it, the
+        full-text index serves the plain one
         """
-        ret = dict()
-        deadline = None
+        if self._index is None:
+            self._index = SearchIndex()
 
-        for line in TextFormat.split_multiline(task):
-            deadline_candidate = DateTime.parse_datetime(line)
+            for task in self:
+                self._index.add(task)
 
-            if line.startswith(PlainTextQueue._DUE_MARKER):
-                break
+        return self._index
 
-            if deadline_candidate is not None:
-                if deadline is None:
-                    deadline = deadline_candidate
-                elif deadline_candidate < deadline:
-                    deadline = deadline_candidate
+    def sort(self, category, key):
+        """
+        The order is kept by the table's indices
+        """
+        pass
 
-        if deadline is not None:
-            ret["due"] = datetime.datetime.strftime(deadline, TIME_FORMAT)
 
-        return ret
+class SqliteQueue(PlainTextQueue):
+    """
+    Keeps the queue in an SQLite database, which is read lazily: loading
+    reads nothing, and searches and modifications only read the rows they
+    need. The listings still show the whole "done" section, row by row as it
+    gets printed, so a large archive is only skipped w/ `--limit` or
+    `--page`. Deadlines are indexed, and the tasks are indexed for full-text
+    search w/ FTS5, if the SQLite build has it.
+
+    Tasks are stored as they are read from "todo.txt". The latter remains
+    the format to sync through w/ `export` and `import`.
+    """
+    QUEUE_FILE = str(Path(os.path.dirname(os.path.realpath(__file__))).resolve() / "todo.db")
+    _SCHEMA_VERSION = 1
+    _SCHEMA = [
+        "CREATE TABLE tasks (id INTEGER PRIMARY KEY, body TEXT NOT NULL UNIQUE, header TEXT NOT NULL, "
+            "details TEXT NOT NULL, due_ts INTEGER, done INTEGER NOT NULL)",
+        "CREATE INDEX tasks_due ON tasks (done, due_ts IS NULL, due_ts, body)",
+        "CREATE INDEX tasks_done ON tasks (done)",
+    ]
+    # Substring search, the trigram tokenizer needs SQLite 3.34+
+    _SCHEMA_FTS = [
+        "CREATE VIRTUAL TABLE tasks_fts USING fts5(body, content='tasks', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+            "INSERT INTO tasks_fts (rowid, body) VALUES (new.id, new.body); END",
+        "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+            "INSERT INTO tasks_fts (tasks_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    ]
+    _FTS_QUERY_MIN = 3  # Trigrams
 
     @staticmethod
-    def _task_parse_info(task):
-        details = PlainTextQueue._task_parse_details(task)
-        due = PlainTextQueue._task_parse_due_date(task)
+    def load(from_here=False, lock=False):
+        import sqlite3
 
-        return dict(
-            **details,
-            **due
-        )
+        if not from_here:
+            queue_file = SqliteQueue.QUEUE_FILE
+        else:
+            queue_file = str(Path(".").resolve() / "todo.db")
 
-    def save(self, here=False):
-        self._sort()
+        queue_dir = os.path.dirname(queue_file)
+        queue_lock = QueueLock.acquire(queue_dir) if lock else None
+        db = None
+        ret = None
 
-        if not here:
-            queue_file = PlainTextQueue.QUEUE_FILE
+        try:
+            db = sqlite3.connect(queue_file)
+            ret = SqliteQueue(SqliteTaskStore(db), queue_dir=queue_dir, lock=queue_lock)
+
+            if db.execute("PRAGMA user_version").fetchone()[0] == 0 and queue_lock is None:
+                # Migration writes, re-check once another instance may have done it
+                ret.lock = QueueLock.acquire(queue_dir)
+
+            if db.execute("PRAGMA user_version").fetchone()[0] == 0:
+                SqliteQueue._schema_create(db)
+                text_file = str(Path(queue_dir) / "todo.txt")
+
+                # First run, migrate
+                if os.path.exists(text_file):
+                    ret.import_text(text_file)
+
+                db.commit()
+
+            return ret
+        except Exception as e:
+            Log.error(SqliteQueue, "got exception", str(e))
+
+            if ret is not None and ret.lock is not queue_lock:
+                ret.lock.release()
+
+            if db is not None:
+                db.close()
+
+            # An in-memory queue, so the database is left as it is, and the changes get lost
+            db = sqlite3.connect(":memory:")
+            SqliteQueue._schema_create(db)
+
+            return SqliteQueue(SqliteTaskStore(db), queue_dir=queue_dir, lock=queue_lock)
+
+    @staticmethod
+    def _schema_create(db):
+        import sqlite3
+
+        for statement in SqliteQueue._SCHEMA:
+            db.execute(statement)
+
+        try:
+            for statement in SqliteQueue._SCHEMA_FTS:
+                db.execute(statement)
+        except sqlite3.OperationalError as e:
+            Log.warning(SqliteQueue, "full-text search is not available", str(e))
+
+        db.execute("PRAGMA user_version = %d" % SqliteQueue._SCHEMA_VERSION)
+
+    def _fts(self):
+        return self.store.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'").fetchone() is not None
+
+    def search_and(self, queries, match_case, category="todo"):
+        """
+        Narrows the search down w/ the full-text index, then checks the
+        candidates the same way `Queue.search_and` does. Queries the index
+        can not serve exactly (too short, non-ASCII case folding) only get
+        checked.
+        """
+        assert category in ["todo", "done"]
+        where = ""
+        params = []
+
+        if self._fts():
+            for q in queries:
+                if len(q) >= SqliteQueue._FTS_QUERY_MIN and q.isascii():
+                    where += " AND id IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?)"
+                    params.append('"%s"' % q.replace('"', '""'))
+
+        if match_case:
+            queries_check = lambda t: all(map(lambda q: q in t, queries))
         else:
-            queue_file = str(Path(".") / "todo.txt")
+            queries = list(map(str.lower, queries))
+            queries_check = lambda t: all(map(lambda q: q in t.lower(), queries))
 
-        serialized = self._as_serialized()
+        return list(filter(queries_check, self.store.select(category, where, params)))
 
-        with open(queue_file, 'w') as f:
-            f.write(serialized)
+    def import_text(self, queue_file):
+        """
+        Replaces the content of the database w/ the one of a "todo.txt" file
+        """
+        with open(queue_file, 'r') as f:
+            store = PlainTextQueue._parse(f, self.queue_dir).store
 
-        # Create a gzipped backup
-        if self.dump:
-            try:
-                os.mkdir(Path(self.queue_dir) / ".tododump")
-            except Exception:
-                pass
+        self.store.clear("todo")
+        self.store.clear("done")
+
+        for category in TaskStore.CATEGORIES:
+            for task, info in store.items(category):
+                self.store.add(task, category, info)
+
+        self._mark_modified()
+        self.ops.append(["import"])
+
+    def backup_points(self):
+        """
+        The database is not journaled, "todo.txt" exports and their git
+        history serve as backups
+        """
+        return []
+
+    def _save(self, here):
+        if not self.dirty:
+            return
+
+        self.store.db.commit()
+        self.dirty = False
+        self.ops = []
 
-            dump_file_path = str((Path(self.queue_dir) / ".tododump" \
-                / DUMP_DURRENT_TIME).resolve()) \
-                + ".txt.gz"
+    def close(self):
+        self.store.db.close()
 
-            with open(dump_file_path, "wb+") as f:
-                output = serialized
-                output = output.encode("raw_unicode_escape")
-                output = gzip.compress(output)
-                f.write(output)
+
+# Selected w/ the `TODO_BACKEND` environment variable
+BACKENDS = {
+    "text": PlainTextQueue,
+    "binary": BinaryQueue,
+    "sqlite": SqliteQueue,
+}
 
 
 class Cli:
     TEXT_EDITOR = "vim"
+    OPTIONS_VALUED = ["--limit"]  # Options that take the next argument as their value
 
     @staticmethod
     def list_select(items, title):
@@ -697,8 +2609,11 @@ class Cli:
         elif len(items) == 1:
             return items[0]
 
+        from simple_term_menu import TerminalMenu
         items_short = list(map(lambda i: TextFormat.split_first_line(i)[0], items))
-        item_id = TerminalMenu(items_short, title=title).show()
+
+        with Trace.phase("TerminalMenu"):
+            item_id = TerminalMenu(items_short, title=title).show()
 
         if item_id is None:
             return None
@@ -714,8 +2629,11 @@ class Cli:
         elif len(items) == 1:
             return [items[0]]
 
+        from simple_term_menu import TerminalMenu
         items_short = list(map(lambda i: TextFormat.split_first_line(i)[0], items))
-        item_ids = TerminalMenu(items_short, title=title, multi_select=True).show()
+
+        with Trace.phase("TerminalMenu"):
+            item_ids = TerminalMenu(items_short, title=title, multi_select=True).show()
 
         if item_ids is None:
             return []
@@ -725,7 +2643,10 @@ class Cli:
         return selected
 
     def yn(title):
-        return bool(TerminalMenu(['[n] No', '[y] Yes'], title=title).show())
+        from simple_term_menu import TerminalMenu
+
+        with Trace.phase("TerminalMenu"):
+            return bool(TerminalMenu(['[n] No', '[y] Yes'], title=title).show())
 
     def print_help():
         entries = [
@@ -735,6 +2656,8 @@ class Cli:
             ["F ..", "Filter tasks (case-sensitive)"],
             ["h ..", "Use  JSON from the current directory"],
             ["a ..", "Add"],
+            ["a -", "Add tasks from stdin, separated by empty lines"],
+            ["batch", "Apply commands from stdin, separated by empty lines:\n\"a TASK\", \"d|u|D|U QUERY\" (do / undo every match)"],
             ["e", "Edit in an external terminal editor \n(vim by default, tweak the source \nfile to replace)"],
             ["e ..", "Filter-edit"],
             ["ae...", "Search for an already existing task using the keywords provided.\nIf none was found, add and open for edit"],
@@ -746,10 +2669,19 @@ class Cli:
             ["u..", "Filter-undo"],
             ["U..", "Filter-undo (case-sensitive)"],
             ["cd", "Clear DONE backlog"],
+            ["restore", "Restore from a backup in .tododump"],
+            ["daemon", "Keep the list in memory, serve the non-interactive commands"],
+            ["export", "Write todo.txt (TODO_BACKEND=binary|sqlite)"],
+            ["import", "Read todo.txt (TODO_BACKEND=binary|sqlite)"],
             ["m", "More. Show details"],
+            ["stats", "Show sizes of the queue and its backups, cache hit rate"],
+            ["--limit N", "Show at most N tasks"],
+            ["--page", "Show one screen of tasks"],
+            ["--fuzzy", "Rank the matches of f, e, d, u by fuzzy search,\nshow the best 20 (or --limit N)"],
+            ["--profile", "Print a timing breakdown to stderr (or TODO_TRACE=1).\n--profile=FILE also dumps cProfile stats"],
         ]
         entries = list(map(lambda i: [Color.colorize_wrap(i[0], *Color.HELP_ENTRY), i[1]], entries))
-        print(tabulate.tabulate(entries, tablefmt="plain", colalign=["left", "left"]))
+        print(_tabulate().tabulate(entries, tablefmt="plain", colalign=["left", "left"]))
 
     def _item_edit_external_editor(items):
         with open(".todotempedit", 'w') as f:
@@ -758,9 +2690,7 @@ class Cli:
         os.system(Cli.TEXT_EDITOR + ' ' + ".todotempedit")
 
         with open(".todotempedit") as f:
-            new_items = TextFormat.split_double_multiline(f.read())
-            new_items = list(map(str.strip, new_items))
-            new_items = list(filter(lambda s: len(s) > 0, new_items))
+            new_items = list(TextFormat.iter_blocks(f))
 
         os.remove(".todotempedit")
 
@@ -786,6 +2716,85 @@ class Cli:
 
         return items, new_items
 
+    @staticmethod
+    def print_entries(entries, max_lines=None):
+        """
+        Writes entries as they get rendered. Stops once `max_lines` lines have
+        been written, or the reader has closed the pipe (e.g. `todo.py m | head`)
+        """
+        try:
+            with Trace.phase("render"):
+                for entry in entries:
+                    if max_lines is not None:
+                        lines = entry.split('\n')
+
+                        if max_lines < len(lines):
+                            sys.stdout.write('\n'.join(lines[:max_lines]) + '\n')
+
+                            break
+
+                        max_lines -= len(lines)
+
+                    sys.stdout.write(entry + '\n')
+
+                sys.stdout.flush()
+        except BrokenPipeError:
+            # Python would complain about the pipe once again at exit
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+
+    @staticmethod
+    def argv_pop_option(name, has_value=False):
+        """
+        Removes an option (e.g. "--limit 10", "--limit=10", or "--page") from
+        `sys.argv`. Returns its value, `True` for a flag, or `None`, if the
+        option is absent. A value missing at the end of the line is `""`.
+        Only the options before the command word (or "h") count, they end at
+        the first other argument or at "--", so task text stays as typed
+        """
+        i = 1
+
+        while i < len(sys.argv):
+            arg = sys.argv[i]
+
+            if arg == 'h' and i == 1:
+                i += 1
+
+                continue
+
+            if arg == '--' or not arg.startswith('--'):
+                break
+
+            if has_value and arg.startswith(name + '='):
+                sys.argv.pop(i)
+
+                return arg[len(name) + 1:]
+            elif arg == name:
+                sys.argv.pop(i)
+
+                if not has_value:
+                    return True
+
+                if i < len(sys.argv):
+                    return sys.argv.pop(i)
+
+                return ""
+
+            i += 2 if arg in Cli.OPTIONS_VALUED else 1
+
+        return None
+
+    @staticmethod
+    def argv_pop_separator():
+        """
+        Removes the "--" that ends the options, if any
+        """
+        for i in [1, 2]:
+            if sys.argv[i:i + 1] == ['--'] and (i == 1 or sys.argv[1] == 'h'):
+                sys.argv.pop(i)
+
+                return
+
     @staticmethod
     def queue_add(q, task):
         task = ' '.join(task)
@@ -795,8 +2804,122 @@ class Cli:
             q.add(task)
 
     @staticmethod
-    def queue_search(q, case_sensitive):
-        item, items = Cli.list_edit_multi(q.search_and(sys.argv[2:], case_sensitive), "Select items to edit")
+    def queue_batch(q, lines, add_only=False):
+        """
+        Applies many commands in one go, so the queue gets loaded, saved, and
+        journaled once. Commands are separated by empty lines:
+        - "a TASK" - add, the task may span several lines
+        - "d QUERY" / "u QUERY" - do / undo every task that matches the query
+        - "D QUERY" / "U QUERY" - same, case-sensitive
+
+        `add_only` - every block is a task to add
+        """
+        for block in TextFormat.iter_blocks(lines):
+            if add_only:
+                q.add(block)
+
+                continue
+
+            command, args = (block.split(None, 1) + [""])[:2]
+
+            if command == 'a':
+                Cli.queue_add(q, [args])
+            elif command in ['d', 'D', 'u', 'U'] and len(args.split()) == 0:
+                # An empty query would match every task
+                Log.warning(Cli, "skipping a batch command w/o a query", command)
+            elif command in ['d', 'D']:
+                for item in q.search_and(args.split(), command == 'D'):
+                    q.do(item)
+            elif command in ['u', 'U']:
+                for item in q.search_and(args.split(), command == 'U', "done"):
+                    q.undo(item)
+            else:
+                Log.warning(Cli, "unknown batch command", TextFormat.split_first_line(block)[0])
+
+    @staticmethod
+    def queue_restore(q):
+        points = q.backup_points()
+
+        if len(points) == 0:
+            print("No backups")
+
+            return
+
+        def point_format(point):
+            if "legacy" in point:
+                return "%s  full dump" % point["legacy"]
+            elif "snapshot" in point:
+                return "%s  snapshot" % point["time"]
+
+            ops = map(lambda op: op[0] + (" " + TextFormat.split_first_line(op[1])[0] if len(op) > 1
+                and type(op[1]) is str else ""), point["ops"])
+
+            return "%s  %s" % (point["time"], ", ".join(ops))
+
+        from simple_term_menu import TerminalMenu
+
+        with Trace.phase("TerminalMenu"):
+            point_id = TerminalMenu(list(map(point_format, points)), title="Restore:").show()
+
+        if point_id is not None:
+            try:
+                q.restore(points[point_id])
+            except ValueError as e:
+                Log.error(Cli, "could not restore", str(e))
+
+    @staticmethod
+    def queue_stats(q):
+        """
+        Prints the size of the queue and of its files, how fast the backups
+        grow, and how many tasks the parse cache has served on load
+        """
+        def size(path):
+            try:
+                return "%d bytes" % os.path.getsize(path)
+            except OSError:
+                return "-"
+
+        queue_dir = Path(q.queue_dir)
+        entries = [
+            ["todo", len(q.todo_tasks())],
+            ["done", len(q.done_tasks())],
+            [Path(type(q).QUEUE_FILE).name, size(queue_dir / Path(type(q).QUEUE_FILE).name)],
+            [ParseCache.CACHE_FILE, size(queue_dir / ParseCache.CACHE_FILE)],
+        ]
+
+        if q.cache is not None and q.cache.hits + q.cache.misses:
+            entries.append(["cache hits", "%d / %d (%.0f%%)" % (q.cache.hits, q.cache.hits + q.cache.misses,
+                100 * q.cache.hits / (q.cache.hits + q.cache.misses))])
+
+        journal = Journal(q.queue_dir, q.DUMP_SUFFIX)
+        dump_files = list(journal.dump_dir.iterdir()) if journal.dump_dir.is_dir() else []
+
+        if len(dump_files):
+            dump_size = sum(f.stat().st_size for f in dump_files)
+            days = max((time.time() - min(f.stat().st_mtime for f in dump_files)) / 86400, 1)
+            entries += [
+                [Journal.DUMP_DIR, "%d bytes, %d files" % (dump_size, len(dump_files))],
+                ["journal entries", len(journal.entries())],
+                ["snapshots", sum(1 for f in dump_files if f.name.endswith(q.DUMP_SUFFIX))],
+                [Journal.DUMP_DIR + " growth", "%d bytes / day" % (dump_size / days)],
+            ]
+
+        print(_tabulate().tabulate(entries, tablefmt="plain", colalign=["left", "left"]))
+
+    @staticmethod
+    def queue_find(q, case_sensitive, category="todo", fuzzy=False, limit=None):
+        """
+        Searches for the queries in `sys.argv`. Fuzzy search is case-insensitive
+        """
+        if fuzzy:
+            return q.search_fuzzy(sys.argv[2:], category, limit)
+
+        return q.search_and(sys.argv[2:], case_sensitive, category)
+
+    @staticmethod
+    def queue_search(q, case_sensitive, fuzzy=False, limit=None):
+        item, items = Cli.list_edit_multi(Cli.queue_find(q, case_sensitive, fuzzy=fuzzy, limit=limit),
+            "Select items to edit")
 
         if item is not None:
             q.item_edit(item, items)
@@ -805,8 +2928,326 @@ class Cli:
 
         return False
 
+    @staticmethod
+    def read_only(argv):
+        """
+        Commands that may modify the queue hold a lock until it gets saved
+        """
+        return len(argv) == 1 or argv[1] in ['f', 'F', 'm', '?', "stats"]
+
+    @staticmethod
+    def command_run(q, limit=None, max_lines=None, fuzzy=False):
+        """
+        Runs the command in `sys.argv` on a queue. `fuzzy` - search w/
+        `Queue.search_fuzzy`, `limit` tells how many matches it returns
+        """
+        if len(sys.argv) >= 3:
+            if sys.argv[1] == 'a' and sys.argv[2:] == ['-']:  # add from stdin
+                Cli.queue_batch(q, sys.stdin, add_only=True)
+            elif sys.argv[1] == 'a':  # add
+                Cli.queue_add(q, sys.argv[2:])
+            elif sys.argv[1] == 'f':  # filter
+                Cli.print_entries(TextFormat.task_format_complete_search_and(q, sys.argv[2:], False, limit, fuzzy),
+                    max_lines)
+            elif sys.argv[1] == 'F':
+                Cli.print_entries(TextFormat.task_format_complete_search_and(q, sys.argv[2:], True, limit, fuzzy),
+                    max_lines)
+            elif sys.argv[1] == 'e':
+                Cli.queue_search(q, False, fuzzy, limit)
+            elif sys.argv[1] == 'E':
+                Cli.queue_search(q, True, fuzzy, limit)
+            elif sys.argv[1] == 'u':  # Filter-undo
+                for item in Cli.list_select_multi(Cli.queue_find(q, False, "done", fuzzy, limit), "Undo:"):
+                    q.undo(item)
+            elif sys.argv[1] == 'U':  # Case-sensitive filter-undo
+                for item in Cli.list_select_multi(Cli.queue_find(q, True, "done", fuzzy, limit), "Undo:"):
+                    q.undo(item)
+            elif sys.argv[1] == 'd':  # Filter-do
+                for item in Cli.list_select_multi(Cli.queue_find(q, False, "todo", fuzzy, limit), "Done: "):
+                    q.do(item)
+            elif sys.argv[1] == 'D':  # Case-sensitive filter-do
+                for item in Cli.list_select_multi(Cli.queue_find(q, True, "todo", fuzzy, limit), "Done: "):
+                    q.do(item)
+            elif sys.argv[1].lower() == "ae":
+                if not Cli.queue_search(q, False, fuzzy, limit):
+                    Cli.queue_add(q, sys.argv[2:])
+                    Cli.queue_search(q, True)
+        elif len(sys.argv) == 2:
+            if sys.argv[1] == 'u':  # undo
+                for item in Cli.list_select_multi(q.done_tasks(), "Undo:"):
+                    q.undo(item)
+            elif sys.argv[1] == 'd':  # do
+                for item in Cli.list_select_multi(q.todo_tasks(), "Done: "):
+                    q.do(item)
+            elif sys.argv[1] == "cd":  # clear done
+                if Cli.yn('Clear "DONE"?'):
+                    q.clear_done()
+            elif sys.argv[1] == 'e':
+                item, items = Cli.list_edit_multi(q.todo_tasks(), "Select items to edit")
+
+                if item is not None:
+                    q.item_edit(item, items)
+            elif sys.argv[1] == 'm':  # more
+                Cli.print_entries(TextFormat.queue_format_complete(q, limit), max_lines)
+            elif sys.argv[1] == "?":
+                Cli.print_help()
+            elif sys.argv[1] == "restore":
+                Cli.queue_restore(q)
+            elif sys.argv[1] == "batch":
+                Cli.queue_batch(q, sys.stdin)
+            elif sys.argv[1] == "stats":
+                Cli.queue_stats(q)
+            elif sys.argv[1] == "export":
+                q.export_text(str(Path(q.queue_dir) / "todo.txt"))
+            elif sys.argv[1] == "import":
+                q.import_text(str(Path(q.queue_dir) / "todo.txt"))
+        elif len(sys.argv) == 1:
+            Cli.print_entries(TextFormat.queue_format_short(q, limit), max_lines)
+
+
+class Daemon:
+    """
+    Keeps a queue in memory and serves the non-interactive commands over a
+    Unix socket in the queue's directory, so they skip importing, loading,
+    and parsing. Before each command, the queue file is checked for
+    changes made elsewhere (e.g. a `git pull`, or an interactive command run
+    in-process), and reloaded. "todo.txt" gets reloaded block by block: only
+    the new or edited blocks are parsed.
+
+    The client sends a JSON object w/ the command line and stdin, and gets
+    the output back. Commands which modify the queue take `QueueLock`, just
+    as they do in-process.
+    """
+    SOCKET_FILE = ".todo.sock"
+    COMMANDS = ['m', 'f', 'F', 'a', "batch", '?']  # Interactive ones run in the client's process
+
+    def __init__(self, backend, from_here):
+        self.backend = backend
+        self.from_here = from_here
+        self.queue_file = backend.QUEUE_FILE if not from_here else str(Path(".").resolve() / Path(backend.QUEUE_FILE).name)
+        self.queue_dir = os.path.dirname(self.queue_file)
+        self.q = None
+        self.stat = None  # Of the queue file, as it was loaded
+
+    @staticmethod
+    def socket_file(queue_dir):
+        return str(Path(queue_dir) / Daemon.SOCKET_FILE)
+
+    @staticmethod
+    def servable(argv):
+        return len(argv) == 1 or argv[1] in Daemon.COMMANDS
+
+    @staticmethod
+    def _file_stat(path):
+        try:
+            st = os.stat(path)
+
+            return st.st_ino, st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _recv(connection):
+        chunks = []
+
+        while True:
+            chunk = connection.recv(1 << 16)
+
+            if not chunk:
+                return json.loads(b"".join(chunks).decode("utf-8"))
+
+            chunks.append(chunk)
+
+    @staticmethod
+    def request(queue_dir, backend, argv, limit, max_lines, fuzzy):
+        """
+        Runs a command in the daemon. Returns `False`, if there is no daemon
+        to run it
+        """
+        import socket
+
+        if not os.path.exists(Daemon.socket_file(queue_dir)):
+            return False
+
+        stdin = sys.stdin.read() if argv[1:] in [['a', '-'], ["batch"]] else ""
+        request = {"argv": argv[1:], "backend": backend, "limit": limit, "max_lines": max_lines, "fuzzy": fuzzy,
+            "stdin": stdin}
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.connect(Daemon.socket_file(queue_dir))
+                connection.sendall(json.dumps(request).encode("utf-8"))
+                connection.shutdown(socket.SHUT_WR)
+                response = Daemon._recv(connection)
+        except (ConnectionError, FileNotFoundError):
+            return False
+
+        if "fallback" in response:
+            Log.info(Daemon, response["error"] + ";", "running the command here")
+            sys.stdin = io.StringIO(stdin)  # Has been read for the daemon
+
+            return False
+        elif "error" in response:
+            Log.error(Daemon, response["error"])
+
+            return True
+
+        stdout = response["stdout"]
+
+        if len(stdout):
+            Cli.print_entries([stdout[:-1] if stdout.endswith('\n') else stdout])
+
+        return True
+
+    def _refresh(self):
+        """
+        Reloads the queue, if its file has changed since it was loaded
+        """
+        stat = Daemon._file_stat(self.queue_file)
+
+        if self.q is not None and stat == self.stat:
+            return
+
+        if self.q is None or self.backend is not PlainTextQueue or stat is None:
+            if self.q is not None:
+                self.q.close()
+
+            self.q = self.backend.load(self.from_here)
+        else:
+            with open(self.queue_file, 'r') as f:
+                q = PlainTextQueue._parse(f, self.queue_dir, self.q.cache, self.q.store)
+
+            q.cache.evict(q.store)
+            q.cache.save()
+            self.q = q
+
+        self.stat = stat
+
+    def _serve_request(self, request):
+        global CURRENT_TIME, DUMP_DURRENT_TIME
+
+        if BACKENDS.get(request["backend"]) is not self.backend:
+            return {"error": "the daemon serves another backend", "fallback": True}
+
+        # E.g. "cd" or "e" would open a menu or an editor on the daemon's terminal
+        if not Daemon.servable([sys.argv[0]] + request["argv"]):
+            return {"error": "the command is not served by the daemon", "fallback": True}
+
+        now = datetime.datetime.now()
+        CURRENT_TIME = datetime.datetime.strftime(now, TIME_FORMAT)
+        DUMP_DURRENT_TIME = datetime.datetime.strftime(now, DUMP_TIME_FORMAT)
+        DateTime.set_reference_time(now)
+        argv = [sys.argv[0]] + request["argv"]
+        lock = None
+
+        # Waiting for e.g. an open editor would hold up every client queued behind
+        if not Cli.read_only(argv):
+            lock = QueueLock.acquire(self.queue_dir, blocking=False)
+
+            if lock is None:
+                return {"error": "the queue is locked by another instance", "fallback": True}
+
+        output = io.StringIO()
+        argv_prev, stdin_prev = sys.argv, sys.stdin
+        sys.argv, sys.stdin = argv, io.StringIO(request["stdin"])
+
+        try:
+            self._refresh()
+
+            # Loading may have taken the lock to migrate the queue
+            if lock is not None:
+                self.q.lock = lock
+
+            with contextlib.redirect_stdout(output):
+                Cli.command_run(self.q, request["limit"], request["max_lines"], request["fuzzy"])
+        finally:
+            sys.argv, sys.stdin = argv_prev, stdin_prev
+
+            if self.q is not None:
+                self.q.save(self.from_here)
+            elif lock is not None:
+                lock.release()
+
+        return {"stdout": output.getvalue()}
+
+    def serve(self):
+        import signal
+        import socket
+
+        socket_file = Daemon.socket_file(self.queue_dir)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            try:
+                server.connect(socket_file)
+                Log.error(Daemon, "already running")
+
+                return
+            except (ConnectionError, FileNotFoundError):
+                pass
+
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+
+        Log.info(Daemon, "serving", self.queue_file)
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))  # Removes the socket on the way out
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_file)
+            server.listen()
+
+            try:
+                while True:
+                    connection, _ = server.accept()
+
+                    with connection:
+                        try:
+                            response = self._serve_request(Daemon._recv(connection))
+                        except Exception as e:
+                            Log.error(Daemon, "got exception", str(e))
+                            response = {"error": str(e)}
+
+                        try:
+                            connection.sendall(json.dumps(response).encode("utf-8"))
+                        except OSError:
+                            pass  # The client has gone
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(socket_file)
+
+                if self.q is not None:
+                    self.q.close()
+
 
 def main():
+    # The flag first, so the valued form does not take the next argument
+    profile = Cli.argv_pop_option("--profile") or Cli.argv_pop_option("--profile", has_value=True)
+
+    if profile or os.environ.get("TODO_TRACE", "0") not in ["", "0"]:
+        Trace.enable(profile if type(profile) is str else None)
+
+    try:
+        _main()
+    finally:
+        Trace.report()
+
+
+def _main():
+    limit = Cli.argv_pop_option("--limit", has_value=True)
+
+    if limit is not None:
+        if not (limit.isascii() and limit.isdigit()):
+            sys.exit("usage: --limit N, where N is a number of tasks, got %r" % limit)
+
+        limit = int(limit)
+    max_lines = None
+
+    if Cli.argv_pop_option("--page"):
+        max_lines = shutil.get_terminal_size().lines - 1
+
+    fuzzy = bool(Cli.argv_pop_option("--fuzzy"))
+    Cli.argv_pop_separator()
+
     if len(sys.argv) > 1:
         from_here = 'h' == sys.argv[1].strip()
 
@@ -815,58 +3256,34 @@ def main():
     else:
         from_here = False
 
-    q = PlainTextQueue.load(from_here)
-
-    if len(sys.argv) >= 3:
-        if sys.argv[1] == 'a':  # add
-            Cli.queue_add(q, sys.argv[2:])
-        elif sys.argv[1] == 'f':  # filter
-            print(TextFormat.task_format_complete_search_and(q, sys.argv[2:], False))
-        elif sys.argv[1] == 'F':
-            print(TextFormat.task_format_complete_search_and(q, sys.argv[2:], True))
-        elif sys.argv[1] == 'e':
-            Cli.queue_search(q, False)
-        elif sys.argv[1] == 'E':
-            Cli.queue_search(q, True)
-        elif sys.argv[1] == 'u':  # Filter-undo
-            for item in Cli.list_select_multi(q.search_and(sys.argv[2:], False, "done"), "Undo:"):
-                q.undo(item)
-        elif sys.argv[1] == 'U':  # Case-sensitive filter-undo
-            for item in Cli.list_select_multi(q.search_and(sys.argv[2:], True, "done"), "Undo:"):
-                q.undo(item)
-        elif sys.argv[1] == 'd':  # Filter-do
-            for item in Cli.list_select_multi(q.search_and(sys.argv[2:], False), "Done: "):
-                q.do(item)
-        elif sys.argv[1] == 'D':  # Case-sensitive filter-do
-            for item in Cli.list_select_multi(q.search_and(sys.argv[2:], True), "Done: "):
-                q.do(item)
-        elif sys.argv[1].lower() == "ae":
-            if not Cli.queue_search(q, False):
-                Cli.queue_add(q, sys.argv[2:])
-                Cli.queue_search(q, True)
-    elif len(sys.argv) == 2:
-        if sys.argv[1] == 'u':  # undo
-            for item in Cli.list_select_multi(q.done_tasks(), "Undo:"):
-                q.undo(item)
-        elif sys.argv[1] == 'd':  # do
-            for item in Cli.list_select_multi(q.todo_tasks(), "Done: "):
-                q.do(item)
-        elif sys.argv[1] == "cd":  # clear done
-            if Cli.yn('Clear "DONE"?'):
-                q.clear_done()
-        elif sys.argv[1] == 'e':
-            item, items = Cli.list_edit_multi(q.todo_tasks(), "Select items to edit")
-
-            if item is not None:
-                q.item_edit(item, items)
-        elif sys.argv[1] == 'm':  # more
-            print(TextFormat.queue_format_complete(q))
-        elif sys.argv[1] == "?":
-            Cli.print_help()
-    elif len(sys.argv) == 1:
-        print(TextFormat.queue_format_short(q))
-
-    q.save(from_here)
+    backend = os.environ.get("TODO_BACKEND", "text")
+
+    if backend not in BACKENDS:
+        Log.warning("unknown TODO_BACKEND", backend, "using", "text")
+        backend = "text"
+
+    if sys.argv[1:] == ["daemon"]:
+        Daemon(BACKENDS[backend], from_here).serve()
+
+        return
+
+    queue_dir = str(Path(".").resolve()) if from_here else os.path.dirname(BACKENDS[backend].QUEUE_FILE)
+
+    # A traced run is timed in this process
+    if not Trace.enabled and Daemon.servable(sys.argv) and Daemon.request(queue_dir, backend, sys.argv, limit,
+            max_lines, fuzzy):
+        return
+
+    with Trace.phase("load"):
+        q = BACKENDS[backend].load(from_here, lock=not Cli.read_only(sys.argv))
+
+    with Trace.phase("command"):
+        Cli.command_run(q, limit, max_lines, fuzzy)
+
+    with Trace.phase("save"):
+        q.save(from_here)
+
+    q.close()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,17 @@
 #!/bin/bash
 
 NOW=$(date +%Y%m%d.%H%M)
+TODO="$(dirname "$(realpath "$0")")/todo.py"
+
+# The binary and SQLite backends sync through todo.txt
+if [ -n "$TODO_BACKEND" ] && [ "$TODO_BACKEND" != "text" ]; then
+	SYNC=1
+fi
+
+[ -n "$SYNC" ] && "$TODO" export
 git fetch origin
 git rebase origin/master
+[ -n "$SYNC" ] && "$TODO" import
 git add .
 git commit -m "$NOW"
 git push origin HEAD